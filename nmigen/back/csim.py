@@ -0,0 +1,503 @@
+import os
+import ctypes
+import hashlib
+import operator
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+from ..hdl.ast import *
+from ..hdl.ast import _value_operands, _iter_postorder
+from ..hdl.xfrm import ValueVisitor, StatementVisitor
+
+
+__all__ = ["CompilerError"]
+
+
+class CompilerError(Exception):
+    pass
+
+
+# Every value is kept in an `int64_t`, normalized to its shape the same way `Const.normalize`
+# does it. Values wider than 63 bits cannot be represented this way, and fragments that contain
+# any of them are simulated by the Python engine instead.
+_MAX_WIDTH = 63
+
+# Expressions are translated into a single nested C expression, which neither the translator
+# nor C compilers handle well once it gets very deep; such expressions are simulated by
+# the Python engine as well.
+_MAX_DEPTH = 200
+
+# C compilers' optimizers are superlinear in function size, and large memories translate into
+# functions with thousands of straight-line stores that gain little from optimization anyway;
+# sources larger than this are compiled without optimization.
+_OPTIMIZE_LIMIT = 65536
+
+# Compiled designs are cached by the hash of their source. Only this many of the most recently
+# used libraries are kept; older ones are removed whenever a new one is built.
+_CACHE_LIMIT = 64
+
+_PRELUDE = """\
+#include <stdint.h>
+
+static inline int64_t norm_u(int64_t x, unsigned w) {
+    return w == 0 ? 0 : (int64_t)((uint64_t)x & (UINT64_MAX >> (64 - w)));
+}
+
+static inline int64_t norm_s(int64_t x, unsigned w) {
+    if (w == 0) return 0;
+    uint64_t s = (uint64_t)1 << (w - 1);
+    uint64_t m = (uint64_t)x & (UINT64_MAX >> (64 - w));
+    return (int64_t)(m ^ s) - (int64_t)s;
+}
+
+static inline int64_t shl(int64_t x, int64_t n) {
+    if (n < 0) return n <= -64 ? (x < 0 ? -1 : 0) : x >> -n;
+    return n >= 64 ? 0 : (int64_t)((uint64_t)x << n);
+}
+
+static inline int64_t shr(int64_t x, int64_t n) {
+    if (n < 0) return n <= -64 ? 0 : (int64_t)((uint64_t)x << -n);
+    return n >= 64 ? (x < 0 ? -1 : 0) : x >> n;
+}
+"""
+
+
+def _literal(value):
+    return "INT64_C({})".format(value)
+
+
+def _normalize(expr, shape):
+    nbits, signed = shape
+    return "{}({}, {})".format("norm_s" if signed else "norm_u", expr, nbits)
+
+
+class _CFunctionState:
+    def __init__(self, signal_slots, name):
+        self.signal_slots = signal_slots
+        self.name         = name
+        self.curr_slots   = OrderedDict() # int/slot -> int/index
+        self.next_slots   = OrderedDict() # int/slot -> int/index
+        self.lhs_indices  = OrderedDict() # int/index -> None
+        self.helpers      = [] # [str/definition]
+        self.temporaries  = 0
+
+    def curr(self, slot):
+        if slot not in self.curr_slots:
+            self.curr_slots[slot] = len(self.curr_slots)
+        return "c[{}]".format(self.curr_slots[slot])
+
+    def next(self, slot):
+        if slot not in self.next_slots:
+            self.next_slots[slot] = len(self.next_slots)
+        return "n[{}]".format(self.next_slots[slot])
+
+    def temporary(self):
+        self.temporaries += 1
+        return "t{}".format(self.temporaries)
+
+    def helper(self, body):
+        """Define a function that takes the same arguments as the function being translated and
+        returns ``int64_t``, and return an expression calling it."""
+        name = "{}_h{}".format(self.name, len(self.helpers))
+        self.helpers.append("static int64_t {}(const int64_t *c, int64_t *n) {{ {} }}\n"
+                            .format(name, body))
+        return "{}(c, n)".format(name)
+
+
+def _value_depth(value):
+    depths = {}
+    for node in _iter_postorder(value):
+        depths[id(node)] = 1 + max((depths[id(operand)] for operand in _value_operands(node)),
+                                   default=0)
+    return depths[id(value)]
+
+
+class _CValueCompiler(ValueVisitor):
+    _in_call = False
+
+    def __call__(self, value):
+        if len(value) > _MAX_WIDTH:
+            raise NotImplementedError("Values wider than {} bits cannot be simulated in C"
+                                      .format(_MAX_WIDTH))
+        if self._in_call:
+            return self.on_value(value)
+        if _value_depth(value) > _MAX_DEPTH:
+            raise NotImplementedError("Values nested deeper than {} levels cannot be simulated "
+                                      "in C".format(_MAX_DEPTH))
+        self._in_call = True
+        try:
+            return self.on_value(value)
+        finally:
+            self._in_call = False
+
+    def on_AnyConst(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_AnySeq(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_Sample(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_ClockSignal(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_ResetSignal(self, value):
+        raise NotImplementedError # :nocov:
+
+    def on_Record(self, value):
+        return self(Cat(value.fields.values()))
+
+
+class _CRHSValueCompiler(_CValueCompiler):
+    def __init__(self, state, mode="rhs"):
+        self.state       = state
+        self.signal_mode = mode
+
+    def on_Const(self, value):
+        return _literal(value.value)
+
+    def on_Signal(self, value):
+        if value not in self.state.signal_slots:
+            # A signal that is neither driven nor a port always remains at its reset state.
+            return _literal(Const.normalize(value.reset, value.shape()))
+        value_slot = self.state.signal_slots[value]
+        if self.signal_mode == "rhs":
+            return self.state.curr(value_slot)
+        elif self.signal_mode == "lhs":
+            return self.state.next(value_slot)
+        else:
+            raise ValueError # :nocov:
+
+    def on_Operator(self, value):
+        shape = value.shape()
+        if len(value.operands) == 1:
+            arg, = map(self, value.operands)
+            if value.op == "~":
+                return _normalize("~{}".format(arg), shape)
+            if value.op == "-":
+                return _normalize("(int64_t)-(uint64_t){}".format(arg), shape)
+            if value.op == "b":
+                return "(int64_t)({} != 0)".format(arg)
+        elif len(value.operands) == 2:
+            lhs, rhs = map(self, value.operands)
+            if value.op in ("+", "-", "*"):
+                return _normalize("(int64_t)((uint64_t){} {} (uint64_t){})"
+                                  .format(lhs, value.op, rhs), shape)
+            if value.op in ("&", "|", "^"):
+                return _normalize("({} {} {})".format(lhs, value.op, rhs), shape)
+            if value.op == "<<":
+                return _normalize("shl({}, {})".format(lhs, rhs), shape)
+            if value.op == ">>":
+                return _normalize("shr({}, {})".format(lhs, rhs), shape)
+            if value.op in ("==", "!=", "<", "<=", ">", ">="):
+                return "(int64_t)({} {} {})".format(lhs, value.op, rhs)
+        elif len(value.operands) == 3:
+            if value.op == "m":
+                sel, val1, val0 = map(self, value.operands)
+                return "({} ? {} : {})".format(sel, val1, val0)
+        raise NotImplementedError("Operator '{}' not implemented".format(value.op)) # :nocov:
+
+    def on_Slice(self, value):
+        arg  = self(value.value)
+        mask = (1 << (value.end - value.start)) - 1
+        return _normalize("(shr({}, {}) & {})".format(arg, value.start, _literal(mask)),
+                          value.shape())
+
+    def on_Part(self, value):
+        arg   = self(value.value)
+        shift = self(value.offset)
+        mask  = (1 << value.width) - 1
+        return _normalize("(shr({}, {}) & {})".format(arg, shift, _literal(mask)),
+                          value.shape())
+
+    def on_Cat(self, value):
+        parts  = []
+        offset = 0
+        for opnd in value.parts:
+            mask = (1 << len(opnd)) - 1
+            parts.append("shl({} & {}, {})".format(self(opnd), _literal(mask), offset))
+            offset += len(opnd)
+        if not parts:
+            return _literal(0)
+        return _normalize("({})".format(" | ".join(parts)), value.shape())
+
+    def on_Repl(self, value):
+        offset = len(value.value)
+        opnd   = "({} & {})".format(self(value.value), _literal((1 << offset) - 1))
+        result = _literal(0)
+        for _ in range(value.count):
+            result = "(shl({}, {}) | {})".format(result, offset, opnd)
+        return _normalize(result, value.shape())
+
+    def on_ArrayProxy(self, value):
+        shape = value.shape()
+        elems = list(map(self, value.elems))
+        index = self(value.index)
+        # The index is evaluated once, and the element is selected with a switch in a helper
+        # function, so that the generated code stays flat however many elements there are.
+        # Out of bounds indexes select the last element, as in the Python engine.
+        cases = " ".join("case {}: return {};".format(elem_index, _normalize(elem, shape))
+                         for elem_index, elem in enumerate(elems[:-1]))
+        return self.state.helper(
+            "int64_t i = {index}; if (i < 0) i += {n}; "
+            "switch (i) {{ {cases} default: return {last}; }}"
+            .format(index=index, n=len(elems), cases=cases,
+                    last=_normalize(elems[-1], shape)))
+
+
+class _CLHSValueCompiler(_CValueCompiler):
+    def __init__(self, state, rhs_compiler):
+        self.state        = state
+        self.rhs_compiler = rhs_compiler
+
+    def on_Const(self, value):
+        raise TypeError # :nocov:
+
+    def on_Signal(self, value):
+        shape = value.shape()
+        value_slot = self.state.signal_slots[value]
+        target = self.state.next(value_slot)
+        self.state.lhs_indices[self.state.next_slots[value_slot]] = None
+        def emit(rhs):
+            return "{} = {};".format(target, _normalize(rhs, shape))
+        return emit
+
+    def on_Operator(self, value):
+        raise TypeError # :nocov:
+
+    def on_Slice(self, value):
+        lhs_r = self.rhs_compiler(value.value)
+        lhs_l = self(value.value)
+        mask  = _literal((1 << (value.end - value.start)) - 1)
+        shift = value.start
+        def emit(rhs):
+            temp = self.state.temporary()
+            return "{{ int64_t {t} = {rhs}; {body} }}".format(t=temp, rhs=rhs,
+                body=lhs_l("(({r} & ~shl({m}, {s})) | shl({t} & {m}, {s}))"
+                           .format(r=lhs_r, m=mask, s=shift, t=temp)))
+        return emit
+
+    def on_Part(self, value):
+        lhs_r = self.rhs_compiler(value.value)
+        lhs_l = self(value.value)
+        shift = self.rhs_compiler(value.offset)
+        mask  = _literal((1 << value.width) - 1)
+        def emit(rhs):
+            temp = self.state.temporary()
+            return "{{ int64_t {t} = {rhs}; {body} }}".format(t=temp, rhs=rhs,
+                body=lhs_l("(({r} & ~shl({m}, {s})) | shl({t} & {m}, {s}))"
+                           .format(r=lhs_r, m=mask, s=shift, t=temp)))
+        return emit
+
+    def on_Cat(self, value):
+        parts  = []
+        offset = 0
+        for opnd in value.parts:
+            parts.append((offset, _literal((1 << len(opnd)) - 1), self(opnd)))
+            offset += len(opnd)
+        def emit(rhs):
+            temp = self.state.temporary()
+            return "{{ int64_t {t} = {rhs}; {body} }}".format(t=temp, rhs=rhs,
+                body=" ".join(opnd("(shr({}, {}) & {})".format(temp, offset, mask))
+                              for offset, mask, opnd in parts))
+        return emit
+
+    def on_Repl(self, value):
+        raise TypeError # :nocov:
+
+    def on_ArrayProxy(self, value):
+        elems = list(map(self, value.elems))
+        index = self.rhs_compiler(value.index)
+        def emit(rhs):
+            temp  = self.state.temporary()
+            temp_index = self.state.temporary()
+            cases = " ".join("case {}: {} break;".format(elem_index, elem(temp))
+                             for elem_index, elem in enumerate(elems))
+            # Out of bounds indexes select the last element, as in the Python engine.
+            return ("{{ int64_t {t} = {rhs}; int64_t {i} = {index}; "
+                    "if ({i} >= {n}) {i} = {n} - 1; if ({i} < 0) {i} += {n}; "
+                    "switch ({i}) {{ {cases} }} }}"
+                    .format(t=temp, rhs=rhs, i=temp_index, index=index, n=len(elems),
+                            cases=cases))
+        return emit
+
+
+class _CStatementCompiler(StatementVisitor):
+    def __init__(self, state):
+        self.state         = state
+        self.rrhs_compiler = _CRHSValueCompiler(state, mode="rhs")
+        self.lrhs_compiler = _CRHSValueCompiler(state, mode="lhs")
+        self.lhs_compiler  = _CLHSValueCompiler(state, self.lrhs_compiler)
+
+    def on_Assign(self, stmt):
+        lhs = self.lhs_compiler(stmt.lhs)
+        rhs = self.rrhs_compiler(stmt.rhs)
+        return lhs(_normalize(rhs, stmt.lhs.shape()))
+
+    def on_Assert(self, stmt):
+        raise NotImplementedError("Asserts not yet implemented for Simulator backend.")
+
+    def on_Assume(self, stmt):
+        return ""
+
+    def on_Switch(self, stmt):
+        test  = self.rrhs_compiler(stmt.test)
+        temp  = self.state.temporary()
+        cases = []
+        for value, stmts in stmt.cases.items():
+            if "-" in value:
+                mask  = "".join("0" if b == "-" else "1" for b in value)
+                value = "".join("0" if b == "-" else  b  for b in value)
+            else:
+                mask  = "1" * len(value)
+            mask  = int(mask,  2) if mask  else 0
+            value = int(value, 2) if value else 0
+            cases.append("if (({} & {}) == {}) {{ {} }}".format(
+                temp, _literal(mask), _literal(value), self.on_statements(stmts)))
+        if not cases:
+            return ""
+        return "{{ int64_t {} = {}; {} }}".format(temp, test, " else ".join(cases))
+
+    def on_statements(self, stmts):
+        return " ".join(self.on_statement(stmt) for stmt in stmts)
+
+
+def _gatherer(slots):
+    if len(slots) == 0:
+        return lambda values: ()
+    elif len(slots) == 1:
+        slot, = slots
+        return lambda values: (values[slot],)
+    else:
+        return operator.itemgetter(*slots)
+
+
+class _CFunclet:
+    """A compiled group of statements, called by the Python engine in place of the funclet
+    produced by ``_StatementCompiler``.
+
+    The values of the signals the statements read are gathered from the simulator state into
+    preallocated ``int64_t`` arrays before each call, and the values of the signals they drive
+    are scattered back afterwards.
+    """
+    def __init__(self, name, curr_slots, next_slots, lhs_indices):
+        self.name        = name
+        self.curr_slots  = curr_slots
+        self.next_slots  = next_slots
+        self.lhs_slots   = [(index, next_slots[index]) for index in lhs_indices]
+        self.curr_values = (ctypes.c_int64 * max(1, len(curr_slots)))()
+        self.next_values = (ctypes.c_int64 * max(1, len(next_slots)))()
+        self.curr_count  = len(curr_slots)
+        self.next_count  = len(next_slots)
+        self.curr_gather = _gatherer(curr_slots)
+        self.next_gather = _gatherer(next_slots)
+        self.function    = None
+
+    def bind(self, library):
+        self.function = getattr(library, self.name)
+        self.function.argtypes = (ctypes.POINTER(ctypes.c_int64),) * 2
+        self.function.restype  = None
+
+    def __call__(self, state):
+        curr_values, next_values = self.curr_values, self.next_values
+        curr_values[:self.curr_count] = self.curr_gather(state.curr)
+        next_values[:self.next_count] = self.next_gather(state.next)
+        self.function(curr_values, next_values)
+        for index, slot in self.lhs_slots:
+            state.set(slot, next_values[index])
+
+
+def _prune_cache(cache_dir):
+    libraries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".so") and entry.is_file():
+            try:
+                libraries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    libraries.sort(reverse=True)
+    for _, path in libraries[_CACHE_LIMIT:]:
+        try:
+            # Removing a library that another simulation has loaded is harmless on POSIX systems.
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class _CProgram:
+    def __init__(self, signal_slots):
+        self.signal_slots = signal_slots
+        self.functions    = []
+        self.funclets     = []
+
+    def add(self, statements):
+        """Translate ``statements`` into a C function, and return a funclet that calls it once
+        the program is built, or ``None`` if the statements cannot be simulated in C."""
+        name  = "f{}".format(len(self.funclets))
+        state = _CFunctionState(self.signal_slots, name)
+        try:
+            body = _CStatementCompiler(state).on_statements(statements)
+        except NotImplementedError:
+            return None
+
+        self.functions.extend(state.helpers)
+        self.functions.append("void {}(const int64_t *c, int64_t *n) {{ {} }}\n"
+                              .format(name, body))
+        funclet = _CFunclet(name, list(state.curr_slots), list(state.next_slots),
+                            list(state.lhs_indices))
+        self.funclets.append(funclet)
+        return funclet
+
+    def build(self):
+        if not self.funclets:
+            return
+
+        source   = _PRELUDE + "".join(self.functions)
+        compiler = os.getenv("CC", "cc")
+        if len(source) > _OPTIMIZE_LIMIT:
+            flags = ["-O0", "-shared", "-fPIC"]
+        else:
+            flags = ["-O2", "-shared", "-fPIC"]
+        digest   = hashlib.sha256("\0".join([compiler, *flags, source]).encode("utf-8"))
+
+        cache_dir = os.getenv("NMIGEN_CSIM_CACHE",
+            os.path.join(os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                         "nmigen", "csim"))
+        os.makedirs(cache_dir, exist_ok=True)
+        library_path = os.path.join(cache_dir, "{}.so".format(digest.hexdigest()))
+
+        if not os.path.exists(library_path):
+            with tempfile.TemporaryDirectory(dir=cache_dir) as build_dir:
+                source_path = os.path.join(build_dir, "design.c")
+                output_path = os.path.join(build_dir, "design.so")
+                with open(source_path, "w") as f:
+                    f.write(source)
+                try:
+                    popen = subprocess.Popen([compiler, *flags, "-o", output_path, source_path],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        encoding="utf-8")
+                except FileNotFoundError as e:
+                    if os.getenv("CC"):
+                        raise CompilerError("Could not find a C compiler in {} as specified "
+                                            "via the CC environment variable"
+                                            .format(os.getenv("CC"))) from e
+                    else:
+                        raise CompilerError("Could not find a C compiler in PATH. Place `cc` "
+                                            "in PATH or specify path explicitly via the CC "
+                                            "environment variable") from e
+                _, error = popen.communicate()
+                if popen.returncode:
+                    raise CompilerError(error.strip())
+                # Another simulation could be building the same library concurrently; make sure
+                # it never observes a partially written file.
+                os.replace(output_path, library_path)
+            _prune_cache(cache_dir)
+        else:
+            os.utime(library_path)
+
+        library = ctypes.CDLL(library_path)
+        for funclet in self.funclets:
+            funclet.bind(library)
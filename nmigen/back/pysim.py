@@ -1,6 +1,10 @@
 import math
+import json
+import heapq
+import struct
 import inspect
 import warnings
+from collections import deque, OrderedDict
 from contextlib import contextmanager
 from bitarray import bitarray
 from vcd import VCDWriter
@@ -9,16 +13,24 @@ from vcd.gtkw import GTKWSave
 from ..tools import flatten
 from ..hdl.ast import *
 from ..hdl.ir import *
+from ..hdl.dsl import FSM
+from ..hdl.ast import _value_operands, _iter_postorder
 from ..hdl.xfrm import ValueVisitor, StatementVisitor
+from .csim import _CProgram
 
 
-__all__ = ["Simulator", "Delay", "Tick", "Passive", "DeadlineError"]
+__all__ = ["Simulator", "Delay", "Tick", "WaitUntil", "Passive", "Coverage", "DeadlineError",
+           "ReplayError"]
 
 
 class DeadlineError(Exception):
     pass
 
 
+class ReplayError(Exception):
+    pass
+
+
 class _State:
     __slots__ = ("curr", "curr_dirty", "next", "next_dirty")
 
@@ -70,7 +82,352 @@ class _State:
             yield slot
 
 
-normalize = Const.normalize
+class _CoverageState(_State):
+    __slots__ = ("rose", "fell", "fsms")
+
+    def __init__(self):
+        super().__init__()
+        self.rose = []
+        self.fell = []
+        self.fsms = dict() # int/slot -> [int/width, int/states, int/transitions]
+
+    def add(self, value):
+        self.rose.append(0)
+        self.fell.append(0)
+        return super().add(value)
+
+    def add_fsm(self, slot, width):
+        self.fsms[slot] = [width, 1 << self.curr[slot], 0]
+
+    def commit(self, slot):
+        old_value = self.curr[slot]
+        new_value = self.next[slot]
+        if old_value != new_value:
+            self.next_dirty[slot] = False
+            self.curr_dirty[slot] = True
+            self.curr[slot] = new_value
+            self.rose[slot] |= ~old_value &  new_value
+            self.fell[slot] |=  old_value & ~new_value
+            if slot in self.fsms:
+                fsm = self.fsms[slot]
+                fsm[1] |= 1 << new_value
+                fsm[2] |= 1 << (old_value << fsm[0] | new_value)
+        return old_value, new_value
+
+
+class Coverage:
+    """Coverage collected by a simulation.
+
+    ``toggles`` maps signal names to ``(width, rose, fell)``, where ``rose`` and ``fell`` are
+    bitmaps of the bits that made a 0 to 1 and a 1 to 0 transition. ``cases`` maps switch
+    statement names to a mapping of case patterns to hit counts. ``fsms`` maps FSM names to
+    ``(decoding, width, states, transitions)``, where ``states`` is a bitmap of the visited
+    state encodings and ``transitions`` is a bitmap of the taken transitions, indexed by
+    ``from << width | to``.
+    """
+    def __init__(self):
+        self.toggles = OrderedDict() # str/name -> (int/width, int/rose, int/fell)
+        self.cases   = OrderedDict() # str/name -> OrderedDict(str/pattern -> int/count)
+        self.fsms    = OrderedDict() # str/name -> (dict/decoding, int/width, int, int)
+
+    def fsm_states(self, name):
+        """Names of the visited states of FSM ``name``."""
+        decoding, width, states, transitions = self.fsms[name]
+        return [decoding.get(n, str(n)) for n in range(1 << width) if states >> n & 1]
+
+    def fsm_transitions(self, name):
+        """Pairs of names of the states of FSM ``name`` between which a transition was taken."""
+        decoding, width, states, transitions = self.fsms[name]
+        mask = (1 << width) - 1
+        return [(decoding.get(n >> width, str(n >> width)), decoding.get(n & mask, str(n & mask)))
+                for n in range(1 << 2 * width) if transitions >> n & 1]
+
+    def merge(self, other):
+        """Merge coverage collected by another simulation of the same design into this one."""
+        for name, (width, rose, fell) in other.toggles.items():
+            if name in self.toggles:
+                self_width, self_rose, self_fell = self.toggles[name]
+                if self_width != width:
+                    raise ValueError("Cannot merge toggle coverage for signal '{}' of width {} "
+                                     "with coverage of width {}"
+                                     .format(name, self_width, width))
+                rose |= self_rose
+                fell |= self_fell
+            self.toggles[name] = (width, rose, fell)
+
+        for name, counts in other.cases.items():
+            self_counts = self.cases.setdefault(name, OrderedDict())
+            for pattern, count in counts.items():
+                self_counts[pattern] = self_counts.get(pattern, 0) + count
+
+        for name, (decoding, width, states, transitions) in other.fsms.items():
+            if name in self.fsms:
+                self_decoding, self_width, self_states, self_transitions = self.fsms[name]
+                if self_width != width:
+                    raise ValueError("Cannot merge state coverage for FSM '{}' of width {} "
+                                     "with coverage of width {}"
+                                     .format(name, self_width, width))
+                decoding = {**self_decoding, **decoding}
+                states |= self_states
+                transitions |= self_transitions
+            self.fsms[name] = (decoding, width, states, transitions)
+
+        return self
+
+    def save(self, file):
+        json.dump({
+            "toggles": [[name, width, hex(rose), hex(fell)]
+                        for name, (width, rose, fell) in self.toggles.items()],
+            "cases":   [[name, list(counts.items())]
+                        for name, counts in self.cases.items()],
+            "fsms":    [[name, sorted(decoding.items()), width, hex(states), hex(transitions)]
+                        for name, (decoding, width, states, transitions) in self.fsms.items()],
+        }, file)
+
+    @classmethod
+    def load(cls, file):
+        data = json.load(file)
+        coverage = cls()
+        for name, width, rose, fell in data["toggles"]:
+            coverage.toggles[name] = (width, int(rose, 16), int(fell, 16))
+        for name, counts in data["cases"]:
+            coverage.cases[name] = OrderedDict(counts)
+        for name, decoding, width, states, transitions in data["fsms"]:
+            coverage.fsms[name] = (dict(decoding), width, int(states, 16), int(transitions, 16))
+        return coverage
+
+
+normalize  = Const.normalize
+normalizer = Const.normalizer
+
+
+def _strongly_connected_components(successors):
+    """Find the strongly connected components of a graph, given as a list of lists of successors
+    of each vertex, using an iterative variant of Tarjan's algorithm. Components are returned in
+    topological order."""
+    indexes    = [None] * len(successors)
+    lowlinks   = [0] * len(successors)
+    on_stack   = [False] * len(successors)
+    stack      = []
+    components = []
+    next_index = 0
+    for root in range(len(successors)):
+        if indexes[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            vertex, position = work.pop()
+            if position == 0:
+                indexes[vertex] = lowlinks[vertex] = next_index
+                next_index += 1
+                stack.append(vertex)
+                on_stack[vertex] = True
+            else:
+                # Returning from the successor that was visited last.
+                successor = successors[vertex][position - 1]
+                lowlinks[vertex] = min(lowlinks[vertex], lowlinks[successor])
+            vertex_successors = successors[vertex]
+            while position < len(vertex_successors):
+                successor = vertex_successors[position]
+                position += 1
+                if indexes[successor] is None:
+                    work.append((vertex, position))
+                    work.append((successor, 0))
+                    break
+                elif on_stack[successor]:
+                    lowlinks[vertex] = min(lowlinks[vertex], indexes[successor])
+            else:
+                if lowlinks[vertex] == indexes[vertex]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == vertex:
+                            break
+                    components.append(component)
+    components.reverse()
+    return components
+
+
+def _vcd_timescale(resolution):
+    for unit, scale in (("s", 1e0), ("ms", 1e-3), ("us", 1e-6),
+                        ("ns", 1e-9), ("ps", 1e-12), ("fs", 1e-15)):
+        for magnitude in (100, 10, 1):
+            if math.isclose(resolution, magnitude * scale):
+                return "{} {}".format(magnitude, unit)
+    raise ValueError("Simulation resolution {} cannot be used as a VCD timescale; the resolution "
+                     "must be 1, 10 or 100 s, ms, us, ns, ps or fs"
+                     .format(resolution))
+
+
+class _StimulusLog:
+    """Compact binary log of every signal access made by simulator processes.
+
+    The log starts with a header identifying the simulation (the number of signal slots, the
+    resolution of timestamps and the names of clock domains), followed by fixed size records
+    ``(kind, timestamp, domain, slot, length)``, each followed by ``length`` bytes of
+    a little-endian two's complement value. The ``domain`` field is the index of the clock domain
+    whose tick woke the process that made the access, or -1 if it was woken by a deadline.
+    """
+    MAGIC  = b"nMigenS1"
+    HEADER = struct.Struct("<IdH")
+    NAME   = struct.Struct("<H")
+    RECORD = struct.Struct("<BqiIH")
+
+    WRITE, READ, END = range(3)
+
+    @classmethod
+    def writer(cls, file, slot_count, resolution, domains):
+        domain_indices = {domain: index for index, domain in enumerate(domains)}
+        file.write(cls.MAGIC)
+        file.write(cls.HEADER.pack(slot_count, resolution, len(domain_indices)))
+        for domain in domain_indices:
+            name = domain.encode("utf-8")
+            file.write(cls.NAME.pack(len(name)))
+            file.write(name)
+
+        pack = cls.RECORD.pack
+        def write(kind, timestamp, domain, slot=0, value=0):
+            if value:
+                data = value.to_bytes((value.bit_length() + 8) // 8, "little", signed=True)
+            else:
+                data = b""
+            domain_index = -1 if domain is None else domain_indices[domain]
+            file.write(pack(kind, timestamp, domain_index, slot, len(data)))
+            file.write(data)
+        return write
+
+    @classmethod
+    def reader(cls, file, slot_count, resolution, domains):
+        def read_exactly(size):
+            data = file.read(size)
+            if len(data) != size:
+                raise ReplayError("Stimulus log is truncated")
+            return data
+
+        if read_exactly(len(cls.MAGIC)) != cls.MAGIC:
+            raise ReplayError("Stimulus log has an unrecognized format")
+        log_slot_count, log_resolution, domain_count = \
+            cls.HEADER.unpack(read_exactly(cls.HEADER.size))
+        log_domains = []
+        for _ in range(domain_count):
+            name_size, = cls.NAME.unpack(read_exactly(cls.NAME.size))
+            log_domains.append(read_exactly(name_size).decode("utf-8"))
+        if log_slot_count != slot_count or set(log_domains) != set(domains):
+            raise ReplayError("Stimulus log was recorded for a different design")
+        if log_resolution != resolution:
+            raise ReplayError("Stimulus log was recorded with resolution {}, but the simulation "
+                              "has resolution {}"
+                              .format(log_resolution, resolution))
+
+        def read():
+            unpack = cls.RECORD.unpack
+            while True:
+                header = file.read(cls.RECORD.size)
+                if not header:
+                    break
+                if len(header) != cls.RECORD.size:
+                    raise ReplayError("Stimulus log is truncated")
+                kind, timestamp, domain_index, slot, size = unpack(header)
+                value = int.from_bytes(read_exactly(size), "little", signed=True)
+                domain = None if domain_index == -1 else log_domains[domain_index]
+                yield kind, timestamp, domain, slot, value
+        return read()
+
+
+class _StreamWriter:
+    """Simulator-side driver for a valid/ready stream.
+
+    Words queued with ``feed`` are presented on ``data`` with ``valid`` asserted, one word per
+    clock cycle, and retired on every edge of the stream's domain where ``ready`` was asserted.
+    """
+    def __init__(self, data, valid, ready):
+        self.data   = data
+        self.valid  = valid
+        self.ready  = ready
+
+        self._queue = deque()
+        self._valid = False
+
+    def feed(self, iterable):
+        """Queue words to be sent."""
+        self._queue.extend(iterable)
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def busy(self):
+        return bool(self._queue) or self._valid
+
+    def _tick(self, state, data_slot, valid_slot, ready_slot, data_shape):
+        queue = self._queue
+        if self._valid and state.curr[ready_slot]:
+            queue.popleft()
+        if queue:
+            state.set(data_slot, normalize(queue[0], data_shape))
+            state.set(valid_slot, 1)
+            self._valid = True
+        else:
+            state.set(valid_slot, 0)
+            self._valid = False
+
+
+class _StreamReader:
+    """Simulator-side monitor for a valid/ready stream.
+
+    Asserts ``ready`` while more words are expected (always, unless ``expect`` was called), and
+    captures ``data`` on every edge of the stream's domain where ``valid`` and ``ready`` were
+    asserted. If ``latency`` is 1, ``data`` is captured one cycle after the handshake, as with
+    non-FWFT queues.
+    """
+    def __init__(self, data, valid, ready, latency=0):
+        if latency not in (0, 1):
+            raise ValueError("Stream latency must be 0 or 1, not {!r}".format(latency))
+
+        self.data    = data
+        self.valid   = valid
+        self.ready   = ready
+        self.latency = latency
+
+        self._queue     = deque()
+        self._remaining = None
+        self._pending   = False
+
+    def expect(self, count):
+        """Keep the simulation running until ``count`` more words are captured."""
+        if self._remaining is None:
+            self._remaining = 0
+        self._remaining += count
+
+    def drain(self, count=None):
+        """Remove and return up to ``count`` (default: all) of the captured words."""
+        queue = self._queue
+        if count is None or count > len(queue):
+            count = len(queue)
+        return [queue.popleft() for _ in range(count)]
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def busy(self):
+        return self._pending or (self._remaining is not None and self._remaining > 0)
+
+    def _tick(self, state, data_slot, valid_slot, ready_slot, data_shape):
+        curr = state.curr
+        if self._pending:
+            self._queue.append(curr[data_slot])
+            self._pending = False
+        if curr[valid_slot] and curr[ready_slot]:
+            if self.latency == 0:
+                self._queue.append(curr[data_slot])
+            else:
+                self._pending = True
+            if self._remaining is not None:
+                self._remaining -= 1
+        state.set(ready_slot, int(self._remaining is None or self._remaining > 0))
 
 
 class _ValueCompiler(ValueVisitor):
@@ -87,11 +444,77 @@ class _ValueCompiler(ValueVisitor):
         return self(Cat(value.fields.values()))
 
 
+def _merge_steps(*groups):
+    return tuple(OrderedDict((id(cell), (cell, step))
+                             for group in groups for cell, step in group).values())
+
+
 class _RHSValueCompiler(_ValueCompiler):
+    # Evaluating a compiled value calls one nested lambda per level of the expression, so very
+    # deep expressions would exhaust the Python stack. Values that are nested deeper than this are
+    # evaluated as separate steps before the expression itself, and their result is read back.
+    max_depth = 200
+
     def __init__(self, signal_slots, sensitivity=None, mode="rhs"):
         self.signal_slots = signal_slots
         self.sensitivity  = sensitivity
         self.signal_mode  = mode
+        self.compiled     = dict() # id(Value) -> (Value, lambda, int/depth, ((cell, lambda)))
+        self._steps       = None   # [(cell, lambda)]
+
+    def __call__(self, value):
+        if self._steps is not None:
+            return self.on_value(value)
+
+        # Compile the operands of the expression first, using an explicit stack, so that
+        # the recursion in the methods below never goes deeper than the already compiled operands.
+        self._steps = []
+        try:
+            for operand in _iter_postorder(value):
+                self.on_value(operand)
+            compiled = self.on_value(value)
+            steps = _merge_steps(*self._steps)
+        finally:
+            self._steps = None
+
+        if not steps:
+            return compiled
+        def run(state):
+            for cell, step in steps:
+                cell[0] = step(state)
+            return compiled(state)
+        return run
+
+    def on_value(self, value):
+        # Values with operands are compiled only once; this also lets values shared between
+        # several expressions (see ast.interned_values()) be compiled only once.
+        if type(value) not in (Operator, Slice, Part, Cat, Repl):
+            return super().on_value(value)
+
+        if id(value) not in self.compiled:
+            compiled = super().on_value(value)
+            depth, step_groups = 1, []
+            for operand in _value_operands(value):
+                if id(operand) in self.compiled:
+                    _, _, operand_depth, operand_steps = self.compiled[id(operand)]
+                    depth = max(depth, operand_depth + 1)
+                    if operand_steps:
+                        step_groups.append(operand_steps)
+            if len(step_groups) == 1:
+                steps, = step_groups
+            else:
+                steps = _merge_steps(*step_groups)
+            if depth > self.max_depth:
+                cell  = [None]
+                steps = steps + ((cell, compiled),)
+                compiled = lambda state: cell[0]
+                depth = 1
+            self.compiled[id(value)] = (value, compiled, depth, steps)
+
+        value, compiled, depth, steps = self.compiled[id(value)]
+        if steps and self._steps is not None:
+            self._steps.append(steps)
+        return compiled
 
     def on_Const(self, value):
         return lambda state: value.value
@@ -117,71 +540,71 @@ class _RHSValueCompiler(_ValueCompiler):
         raise NotImplementedError # :nocov:
 
     def on_Operator(self, value):
-        shape = value.shape()
+        norm = normalizer(value.shape())
         if len(value.operands) == 1:
             arg, = map(self, value.operands)
             if value.op == "~":
-                return lambda state: normalize(~arg(state), shape)
+                return lambda state: norm(~arg(state))
             if value.op == "-":
-                return lambda state: normalize(-arg(state), shape)
+                return lambda state: norm(-arg(state))
             if value.op == "b":
-                return lambda state: normalize(bool(arg(state)), shape)
+                return lambda state: norm(bool(arg(state)))
         elif len(value.operands) == 2:
             lhs, rhs = map(self, value.operands)
             if value.op == "+":
-                return lambda state: normalize(lhs(state) +  rhs(state), shape)
+                return lambda state: norm(lhs(state) +  rhs(state))
             if value.op == "-":
-                return lambda state: normalize(lhs(state) -  rhs(state), shape)
+                return lambda state: norm(lhs(state) -  rhs(state))
             if value.op == "*":
-                return lambda state: normalize(lhs(state) *  rhs(state), shape)
+                return lambda state: norm(lhs(state) *  rhs(state))
             if value.op == "&":
-                return lambda state: normalize(lhs(state) &  rhs(state), shape)
+                return lambda state: norm(lhs(state) &  rhs(state))
             if value.op == "|":
-                return lambda state: normalize(lhs(state) |  rhs(state), shape)
+                return lambda state: norm(lhs(state) |  rhs(state))
             if value.op == "^":
-                return lambda state: normalize(lhs(state) ^  rhs(state), shape)
+                return lambda state: norm(lhs(state) ^  rhs(state))
             if value.op == "<<":
                 def sshl(lhs, rhs):
                     return lhs << rhs if rhs >= 0 else lhs >> -rhs
-                return lambda state: normalize(sshl(lhs(state), rhs(state)), shape)
+                return lambda state: norm(sshl(lhs(state), rhs(state)))
             if value.op == ">>":
                 def sshr(lhs, rhs):
                     return lhs >> rhs if rhs >= 0 else lhs << -rhs
-                return lambda state: normalize(sshr(lhs(state), rhs(state)), shape)
+                return lambda state: norm(sshr(lhs(state), rhs(state)))
             if value.op == "==":
-                return lambda state: normalize(lhs(state) == rhs(state), shape)
+                return lambda state: norm(lhs(state) == rhs(state))
             if value.op == "!=":
-                return lambda state: normalize(lhs(state) != rhs(state), shape)
+                return lambda state: norm(lhs(state) != rhs(state))
             if value.op == "<":
-                return lambda state: normalize(lhs(state) <  rhs(state), shape)
+                return lambda state: norm(lhs(state) <  rhs(state))
             if value.op == "<=":
-                return lambda state: normalize(lhs(state) <= rhs(state), shape)
+                return lambda state: norm(lhs(state) <= rhs(state))
             if value.op == ">":
-                return lambda state: normalize(lhs(state) >  rhs(state), shape)
+                return lambda state: norm(lhs(state) >  rhs(state))
             if value.op == ">=":
-                return lambda state: normalize(lhs(state) >= rhs(state), shape)
+                return lambda state: norm(lhs(state) >= rhs(state))
         elif len(value.operands) == 3:
             if value.op == "m":
                 sel, val1, val0 = map(self, value.operands)
                 return lambda state: val1(state) if sel(state) else val0(state)
         raise NotImplementedError("Operator '{}' not implemented".format(value.op)) # :nocov:
 
+    # Slices, parts, concatenations and replications are unsigned and masked to their width
+    # while being evaluated, so they never need to be normalized.
+
     def on_Slice(self, value):
-        shape = value.shape()
         arg   = self(value.value)
         shift = value.start
         mask  = (1 << (value.end - value.start)) - 1
-        return lambda state: normalize((arg(state) >> shift) & mask, shape)
+        return lambda state: (arg(state) >> shift) & mask
 
     def on_Part(self, value):
-        shape = value.shape()
         arg   = self(value.value)
         shift = self(value.offset)
         mask  = (1 << value.width) - 1
-        return lambda state: normalize((arg(state) >> shift(state)) & mask, shape)
+        return lambda state: (arg(state) >> shift(state)) & mask
 
     def on_Cat(self, value):
-        shape  = value.shape()
         parts  = []
         offset = 0
         for opnd in value.parts:
@@ -191,11 +614,10 @@ class _RHSValueCompiler(_ValueCompiler):
             result = 0
             for offset, mask, opnd in parts:
                 result |= (opnd(state) & mask) << offset
-            return normalize(result, shape)
+            return result
         return eval
 
     def on_Repl(self, value):
-        shape  = value.shape()
         offset = len(value.value)
         mask   = (1 << len(value.value)) - 1
         count  = value.count
@@ -204,19 +626,19 @@ class _RHSValueCompiler(_ValueCompiler):
             result = 0
             for _ in range(count):
                 result <<= offset
-                result  |= opnd(state)
-            return normalize(result, shape)
+                result  |= opnd(state) & mask
+            return result
         return eval
 
     def on_ArrayProxy(self, value):
-        shape  = value.shape()
+        norm   = normalizer(value.shape())
         elems  = list(map(self, value.elems))
         index  = self(value.index)
         def eval(state):
             index_value = index(state)
             if index_value >= len(elems):
                 index_value = len(elems) - 1
-            return normalize(elems[index_value](state), shape)
+            return norm(elems[index_value](state))
         return eval
 
 
@@ -229,10 +651,10 @@ class _LHSValueCompiler(_ValueCompiler):
         raise TypeError # :nocov:
 
     def on_Signal(self, value):
-        shape = value.shape()
+        norm = normalizer(value.shape())
         value_slot = self.signal_slots[value]
         def eval(state, rhs):
-            state.set(value_slot, normalize(rhs, shape))
+            state.set(value_slot, norm(rhs))
         return eval
 
     def on_ClockSignal(self, value):
@@ -295,18 +717,19 @@ class _LHSValueCompiler(_ValueCompiler):
 
 
 class _StatementCompiler(StatementVisitor):
-    def __init__(self, signal_slots):
+    def __init__(self, signal_slots, case_counts=None):
         self.sensitivity   = SignalSet()
+        self.case_counts   = case_counts
         self.rrhs_compiler = _RHSValueCompiler(signal_slots, self.sensitivity, mode="rhs")
         self.lrhs_compiler = _RHSValueCompiler(signal_slots, self.sensitivity, mode="lhs")
         self.lhs_compiler  = _LHSValueCompiler(signal_slots, self.lrhs_compiler)
 
     def on_Assign(self, stmt):
-        shape = stmt.lhs.shape()
-        lhs   = self.lhs_compiler(stmt.lhs)
-        rhs   = self.rrhs_compiler(stmt.rhs)
+        norm = normalizer(stmt.lhs.shape())
+        lhs  = self.lhs_compiler(stmt.lhs)
+        rhs  = self.rrhs_compiler(stmt.rhs)
         def run(state):
-            lhs(state, normalize(rhs(state), shape))
+            lhs(state, norm(rhs(state)))
         return run
 
     def on_Assert(self, stmt):
@@ -329,12 +752,23 @@ class _StatementCompiler(StatementVisitor):
             def make_test(mask, value):
                 return lambda test: test & mask == value
             cases.append((make_test(mask, value), self.on_statements(stmts)))
-        def run(state):
-            test_value = test(state)
-            for check, body in cases:
-                if check(test_value):
-                    body(state)
-                    return
+        if self.case_counts is None:
+            def run(state):
+                test_value = test(state)
+                for check, body in cases:
+                    if check(test_value):
+                        body(state)
+                        return
+        else:
+            counts = [0] * len(cases)
+            self.case_counts.append((stmt, counts))
+            def run(state):
+                test_value = test(state)
+                for index, (check, body) in enumerate(cases):
+                    if check(test_value):
+                        counts[index] += 1
+                        body(state)
+                        return
         return run
 
     def on_statements(self, stmts):
@@ -346,8 +780,14 @@ class _StatementCompiler(StatementVisitor):
 
 
 class Simulator:
-    def __init__(self, fragment, vcd_file=None, gtkw_file=None, traces=()):
+    def __init__(self, fragment, vcd_file=None, gtkw_file=None, traces=(), coverage=False,
+                 resolution=1e-15, engine="python", trace_filter=None):
+        if engine not in ("python", "c"):
+            raise ValueError("Simulator engine must be one of 'python' or 'c', not {!r}"
+                             .format(engine))
+
         self._fragment        = Fragment.get(fragment, platform=None)
+        self._engine          = engine
 
         self._signal_slots    = SignalDict()  # Signal -> int/slot
         self._slot_signals    = list()        # int/slot -> Signal
@@ -362,21 +802,44 @@ class Simulator:
         self._domain_signals  = dict()        # str/domain -> {Signal}
 
         self._started         = False
-        self._timestamp       = 0.
-        self._delta           = 0.
-        self._epsilon         = 1e-10
-        self._fastest_clock   = self._epsilon
+        self._resolution      = resolution    # seconds per unit of time
+        self._timestamp       = 0             # int/units
+        self._delta           = 0             # int/delta cycles at this timestamp
+        self._delta_limit     = 10000
+        self._fastest_clock   = None          # int/units
         self._all_clocks      = set()         # {str/domain}
-        self._state           = _State()
+        self._state           = _CoverageState() if coverage else _State()
 
         self._processes       = set()         # {process}
         self._process_loc     = dict()        # process -> str/loc
         self._passive         = set()         # {process}
         self._suspended       = set()         # {process}
-        self._wait_deadline   = dict()        # process -> float/timestamp
+        self._wait_deadline   = list()        # heap((int/timestamp, int/order, process))
+        self._wait_order      = 0
         self._wait_tick       = dict()        # process -> str/domain
+        self._wait_until      = dict()        # process -> (str/domain, lambda, [int/slot])
+        self._wait_slots      = dict()        # int/slot -> {process}
+        self._wait_ready      = set()         # {process}
+        self._wait_funclets   = ValueDict()   # Value -> (lambda, [int/slot])
 
         self._funclets        = list()        # int/slot -> set(lambda)
+        self._funclet_order   = dict()        # lambda -> (int/rank, int/index)
+        self._ranked_funclets = list()        # int/position -> lambda
+        self._funclet_ranks   = list()        # int/slot -> [int/position]
+        self._dirty_funclets  = bitarray()    # {int/position}
+
+        self._streams         = dict()        # str/domain -> [(stream, slots, shape, slots)]
+        self._instance_models = dict()        # str/type -> (model, sensitivity)
+
+        self._stimulus_log    = None          # (kind, timestamp, domain, slot, value) -> None
+        self._replay          = None          # iter((kind, timestamp, domain, slot, value))
+        self._replay_next     = None          # (kind, timestamp, domain, slot, value)
+        self._replay_check    = False
+
+        self._coverage        = coverage
+        self._coverage_names  = list()        # int/slot -> str/name
+        self._coverage_cases  = list()        # (str/name, Switch, [int/count])
+        self._coverage_fsms   = list()        # (str/name, FSM)
 
         self._vcd_file        = vcd_file
         self._vcd_writer      = None
@@ -384,6 +847,7 @@ class Simulator:
         self._vcd_names       = list()        # int/slot -> str/name
         self._gtkw_file       = gtkw_file
         self._traces          = traces
+        self._trace_filter    = trace_filter  # str/name -> bool
 
         self._run_called      = False
 
@@ -424,9 +888,134 @@ class Simulator:
         sync_process = sync_process()
         self.add_process(sync_process)
 
+    def add_instance_model(self, type, model, sensitivity=None):
+        """Simulate instances of ``type`` using a Python model.
+
+        ``model`` is called once for every instance of ``type`` with the :class:`Instance` as
+        the argument, and returns a function that maps a dictionary of input (``i_`` and ``io_``)
+        port values to a dictionary of output (``o_`` and ``io_``) port values. That function is
+        called whenever any of the input ports named in ``sensitivity`` (by default, all of them)
+        changes, and the output ports it does not return keep their previous values.
+        """
+        if self._slot_signals:
+            raise ValueError("Instance model for '{}' must be added before the simulation "
+                             "is started"
+                             .format(type))
+        if sensitivity is not None:
+            sensitivity = set(sensitivity)
+        self._instance_models[type] = (model, sensitivity)
+
+    def _compile_instance_model(self, instance, model, sensitivity):
+        rrhs_compiler = _RHSValueCompiler(self._signal_slots, mode="rhs")
+        lrhs_compiler = _RHSValueCompiler(self._signal_slots, mode="lhs")
+        lhs_compiler  = _LHSValueCompiler(self._signal_slots, lrhs_compiler)
+        if sensitivity is not None:
+            for port_name in sensitivity:
+                if port_name not in instance.named_ports or \
+                        instance.named_ports[port_name][1] == "o":
+                    raise NameError("Instance model for '{}' is sensitive to port '{}', which "
+                                    "is not an input port"
+                                    .format(instance.type, port_name))
+
+        inputs  = []
+        outputs = dict()
+        sensitive_signals = SignalSet()
+        for port_name, (value, dir) in instance.named_ports.items():
+            if dir in ("i", "io"):
+                inputs.append((port_name, rrhs_compiler(value)))
+                if sensitivity is None or port_name in sensitivity:
+                    sensitive_signals |= value._rhs_signals()
+            if dir in ("o", "io"):
+                outputs[port_name] = (lhs_compiler(value), value.shape())
+                for signal in value._lhs_signals():
+                    self._comb_signals[self._signal_slots[signal]] = True
+
+        eval = model(instance)
+        def run(state):
+            output_values = eval({port_name: input(state) for port_name, input in inputs})
+            for port_name, port_value in output_values.items():
+                try:
+                    output, shape = outputs[port_name]
+                except KeyError:
+                    raise NameError("Instance model for '{}' returned a value for port '{}', "
+                                    "which is not an output port"
+                                    .format(instance.type, port_name)) from None
+                output(state, normalize(port_value, shape))
+        return run, sensitive_signals
+
+    @property
+    def coverage(self):
+        """Coverage collected so far, as a :class:`Coverage`, or ``None`` if the simulator
+        was created without ``coverage=True``."""
+        if not self._coverage:
+            return None
+
+        coverage = Coverage()
+        for signal_slot, name in enumerate(self._coverage_names):
+            width = len(self._slot_signals[signal_slot])
+            mask  = (1 << width) - 1
+            coverage.toggles[name] = (width,
+                                      self._state.rose[signal_slot] & mask,
+                                      self._state.fell[signal_slot] & mask)
+        for name, switch, counts in self._coverage_cases:
+            coverage.cases[name] = OrderedDict(zip(switch.cases, counts))
+        for name, fsm in self._coverage_fsms:
+            if fsm.state in self._signal_slots:
+                width, states, transitions = self._state.fsms[self._signal_slots[fsm.state]]
+                coverage.fsms[name] = (dict(fsm.decoding), width, states, transitions)
+        return coverage
+
+    def record_stimulus(self, file):
+        """Record every signal value written (or read) by simulator processes to ``file``.
+
+        The log can be replayed with ``replay_stimulus`` on a simulation of the same design,
+        without adding any processes or clocks, to reproduce this simulation exactly.
+        """
+        if not self._started:
+            raise ValueError("Stimulus can only be recorded after the simulation is started")
+        self._stimulus_log = _StimulusLog.writer(file, len(self._slot_signals), self._resolution,
+                                                 self._domains)
+
+    def replay_stimulus(self, file, check=False):
+        """Replay a log recorded with ``record_stimulus`` from ``file``.
+
+        If ``check`` is true, every value read by the recorded processes is compared with
+        the value in this simulation, and :class:`ReplayError` is raised if they differ.
+        """
+        if not self._started:
+            raise ValueError("Stimulus can only be replayed after the simulation is started")
+        self._replay = _StimulusLog.reader(file, len(self._slot_signals), self._resolution,
+                                           self._domains)
+        self._replay_next  = next(self._replay, None)
+        self._replay_check = check
+
+    def _replay_stimulus(self, domain):
+        # Replay every access made by the processes that were woken at this point in time.
+        while self._replay_next is not None:
+            kind, timestamp, replay_domain, signal_slot, value = self._replay_next
+            if timestamp != self._timestamp or replay_domain != domain:
+                break
+            self._replay_next = next(self._replay, None)
+
+            if kind == _StimulusLog.WRITE:
+                self._state.set(signal_slot, value)
+                domains = set()
+                self._commit_signal(signal_slot, domains)
+                self._commit_sync_signals(domains)
+            elif kind == _StimulusLog.READ:
+                if self._replay_check and self._state.curr[signal_slot] != value:
+                    raise ReplayError("Signal '{!r}' has value {} at {:g} s, but the recorded "
+                                      "value is {}"
+                                      .format(self._slot_signals[signal_slot],
+                                              self._state.curr[signal_slot],
+                                              self._timestamp * self._resolution, value))
+
+    def _to_units(self, interval):
+        return int(round(interval / self._resolution))
+
     def add_clock(self, period, phase=None, domain="sync"):
-        if self._fastest_clock == self._epsilon or period < self._fastest_clock:
-            self._fastest_clock = period
+        if self._fastest_clock is None or self._to_units(period) < self._fastest_clock:
+            self._fastest_clock = self._to_units(period)
         if domain in self._all_clocks:
             raise ValueError("Domain '{}' already has a clock driving it"
                              .format(domain))
@@ -446,13 +1035,119 @@ class Simulator:
         self.add_process(clk_process)
         self._all_clocks.add(domain)
 
+    def _add_stream(self, stream, domain, driven):
+        slots = []
+        for signal in (stream.data, stream.valid, stream.ready):
+            if signal not in self._signal_slots:
+                raise ValueError("Cannot add a stream driving signal '{!r}', which is not a part "
+                                 "of simulation"
+                                 .format(signal))
+            slots.append(self._signal_slots[signal])
+        for signal in driven:
+            if self._comb_signals[self._signal_slots[signal]]:
+                raise ValueError("Cannot add a stream driving signal '{!r}', which is a part of "
+                                 "combinatorial assignment in simulation"
+                                 .format(signal))
+        if domain not in self._streams:
+            self._streams[domain] = []
+        driven_slots = tuple(self._signal_slots[signal] for signal in driven)
+        self._streams[domain].append((stream, tuple(slots), stream.data.shape(), driven_slots))
+        return stream
+
+    def add_stream_writer(self, data, valid, ready, domain="sync"):
+        """Drive a valid/ready stream from a queue of words, without a simulator process.
+
+        Returns an object whose ``feed(iterable)`` method queues words to be sent.
+        """
+        return self._add_stream(_StreamWriter(data, valid, ready), domain,
+                                driven=(data, valid))
+
+    def add_stream_reader(self, data, valid, ready, domain="sync", latency=0):
+        """Capture words from a valid/ready stream, without a simulator process.
+
+        Returns an object whose ``drain(count)`` method removes and returns captured words, and
+        whose ``expect(count)`` method keeps the simulation running until ``count`` more words
+        are captured.
+        """
+        return self._add_stream(_StreamReader(data, valid, ready, latency), domain,
+                                driven=(ready,))
+
+    def add_fifo_writer(self, fifo, domain="sync"):
+        """Drive the write interface of a :class:`FIFOInterface`; see ``add_stream_writer``."""
+        return self.add_stream_writer(fifo.din, fifo.we, fifo.writable, domain)
+
+    def add_fifo_reader(self, fifo, domain="sync"):
+        """Capture the read interface of a :class:`FIFOInterface`; see ``add_stream_reader``."""
+        return self.add_stream_reader(fifo.dout, fifo.readable, fifo.re, domain,
+                                      latency=0 if fifo.fwft else 1)
+
+    def _register_vcd_signals(self, fragment, fragment_scope, scope_names):
+        # A signal that is a port of a subfragment is named after the first subfragment
+        # that uses it.
+        port_names = SignalDict()
+        for index, (subfragment, name) in enumerate(fragment.subfragments):
+            for signal in subfragment.ports:
+                if signal not in port_names:
+                    port_names[signal] = "{}_{}".format(name or "U{}".format(index), signal.name)
+
+        scope = ".".join(fragment_scope)
+        used_names = scope_names.setdefault(scope, set())
+        for signal in fragment.iter_signals():
+            var_name = port_names.get(signal, signal.name)
+            if var_name in used_names:
+                suffix = 1
+                while "{}${}".format(var_name, suffix) in used_names:
+                    suffix += 1
+                var_name = "{}${}".format(var_name, suffix)
+            used_names.add(var_name)
+
+            hier_name = ".".join(fragment_scope + (var_name,))
+            if self._trace_filter is not None and not self._trace_filter(hier_name):
+                continue
+
+            if signal.decoder:
+                var_type = "string"
+                var_size = 1
+                var_init = signal.decoder(signal.reset).replace(" ", "_")
+            else:
+                var_type = "wire"
+                var_size = signal.nbits
+                var_init = signal.reset
+
+            signal_slot = self._signal_slots[signal]
+            self._vcd_signals[signal_slot].add(self._vcd_writer.register_var(
+                scope=scope, name=var_name,
+                var_type=var_type, size=var_size, init=var_init))
+            if self._vcd_names[signal_slot] is None:
+                self._vcd_names[signal_slot] = hier_name
+
     def __enter__(self):
         if self._vcd_file:
-            self._vcd_writer = VCDWriter(self._vcd_file, timescale="100 ps",
+            self._vcd_writer = VCDWriter(self._vcd_file,
+                                         timescale=_vcd_timescale(self._resolution),
                                          comment="Generated by nMigen")
 
+        if self._coverage:
+            # FSMs are only known to the fragments they were generated in, which are discarded
+            # when the design is prepared for simulation.
+            def add_fsms(fragment, scope):
+                for name, generated in fragment.generated.items():
+                    if isinstance(generated, FSM):
+                        self._coverage_fsms.append((".".join((*scope, name)), generated))
+                for index, (subfragment, name) in enumerate(fragment.subfragments):
+                    add_fsms(subfragment, (*scope, "U{}".format(index) if name is None else name))
+            add_fsms(self._fragment, ("top",))
+
         root_fragment = self._fragment.prepare()
         self._domains = root_fragment.domains
+        self._started = True
+
+        # Statements of fragments are translated to C when possible, but switch case coverage
+        # is only collected by the Python engine.
+        if self._engine == "c" and not self._coverage:
+            c_program = _CProgram(self._signal_slots)
+        else:
+            c_program = None
 
         hierarchy = {}
         def add_fragment(fragment, scope=()):
@@ -502,45 +1197,32 @@ class Simulator:
                 if cd.rst is not None:
                     add_domain_signal(cd.rst, domain)
 
+        if self._coverage:
+            # Name every signal after the fragment that drives it, or the toplevel if none does.
+            scopes = [("top",)] * len(self._slot_signals)
+            for fragment, fragment_scope in hierarchy.items():
+                for domain, signal in fragment.iter_drivers():
+                    scopes[self._signal_slots[signal]] = fragment_scope
+            used_names = set()
+            for signal_slot, signal in enumerate(self._slot_signals):
+                name = ".".join((*scopes[signal_slot], signal.name))
+                suffix = 0
+                while name in used_names:
+                    suffix += 1
+                    name = "{}.{}${}".format(".".join(scopes[signal_slot]), signal.name, suffix)
+                used_names.add(name)
+                self._coverage_names.append(name)
+
+            for name, fsm in self._coverage_fsms:
+                if fsm.state in self._signal_slots:
+                    self._state.add_fsm(self._signal_slots[fsm.state], len(fsm.state))
+
+        comb_order = self._order_comb_signals(hierarchy)
+
+        vcd_scope_names = dict() # str/scope -> {str/name}
         for fragment, fragment_scope in hierarchy.items():
-            for signal in fragment.iter_signals():
-                if not self._vcd_writer:
-                    continue
-
-                signal_slot = self._signal_slots[signal]
-
-                for i, (subfragment, name) in enumerate(fragment.subfragments):
-                    if signal in subfragment.ports:
-                        var_name = "{}_{}".format(name or "U{}".format(i), signal.name)
-                        break
-                else:
-                    var_name = signal.name
-
-                if signal.decoder:
-                    var_type = "string"
-                    var_size = 1
-                    var_init = signal.decoder(signal.reset).replace(" ", "_")
-                else:
-                    var_type = "wire"
-                    var_size = signal.nbits
-                    var_init = signal.reset
-
-                suffix = None
-                while True:
-                    try:
-                        if suffix is None:
-                            var_name_suffix = var_name
-                        else:
-                            var_name_suffix = "{}${}".format(var_name, suffix)
-                        self._vcd_signals[signal_slot].add(self._vcd_writer.register_var(
-                            scope=".".join(fragment_scope), name=var_name_suffix,
-                            var_type=var_type, size=var_size, init=var_init))
-                        if self._vcd_names[signal_slot] is None:
-                            self._vcd_names[signal_slot] = \
-                                ".".join(fragment_scope + (var_name_suffix,))
-                        break
-                    except KeyError:
-                        suffix = (suffix or 0) + 1
+            if self._vcd_writer:
+                self._register_vcd_signals(fragment, fragment_scope, vcd_scope_names)
 
             for domain, signals in fragment.drivers.items():
                 signals_bits = bitarray(len(self._signals))
@@ -572,20 +1254,66 @@ class Simulator:
                         statements += hold_stmts
             statements += fragment.statements
 
-            compiler = _StatementCompiler(self._signal_slots)
-            funclet = compiler(statements)
+            if self._coverage:
+                case_counts = []
+                compiler = _StatementCompiler(self._signal_slots, case_counts)
+                funclet = compiler(statements)
+                for index, (switch, counts) in enumerate(case_counts):
+                    self._coverage_cases.append(
+                        (".".join((*fragment_scope, "switch{}".format(index))), switch, counts))
+            else:
+                compiler = _StatementCompiler(self._signal_slots)
+                funclet = compiler(statements)
+                if c_program is not None:
+                    # Fragments that use values too wide for the C engine stay in Python.
+                    c_funclet = c_program.add(statements)
+                    if c_funclet is not None:
+                        funclet = c_funclet
+
+            # Evaluate fragments in the order in which their combinatorial signals depend on
+            # each other, so that the order of evaluation is deterministic.
+            self._funclet_order[funclet] = \
+                (min((comb_order[self._signal_slots[signal]]
+                      for signal in fragment.iter_comb()), default=len(comb_order)),
+                 len(self._funclet_order))
 
             def add_funclet(signal, funclet):
                 if signal in self._signal_slots:
                     self._funclets[self._signal_slots[signal]].add(funclet)
+                    self._funclet_order.setdefault(funclet,
+                        (len(comb_order), len(self._funclet_order)))
 
             for signal in compiler.sensitivity:
                 add_funclet(signal, funclet)
+
+            if isinstance(fragment, Instance):
+                if fragment.type in self._instance_models:
+                    model_funclet, model_sensitivity = \
+                        self._compile_instance_model(fragment, *self._instance_models[fragment.type])
+                    for signal in model_sensitivity:
+                        add_funclet(signal, model_funclet)
+                elif fragment.type not in ("$memrd", "$memwr"):
+                    warnings.warn("Instance '{}' of type '{}' has no simulation model; its "
+                                  "outputs will remain at their reset values"
+                                  .format(".".join(fragment_scope), fragment.type),
+                                  UserWarning)
             for domain, cd in fragment.domains.items():
                 add_funclet(cd.clk, funclet)
                 if cd.rst is not None:
                     add_funclet(cd.rst, funclet)
 
+        if c_program is not None:
+            c_program.build()
+
+        # Funclets are ordered once here, so that dirty funclets can be run in order without
+        # sorting them at every delta cycle.
+        self._ranked_funclets = sorted(self._funclet_order, key=self._funclet_order.__getitem__)
+        positions = {funclet: position for position, funclet in enumerate(self._ranked_funclets)}
+        self._funclet_ranks = [sorted(positions[funclet] for funclet in funclets)
+                               for funclets in self._funclets]
+        self._dirty_funclets = bitarray(len(self._ranked_funclets))
+        self._dirty_funclets.setall(False)
+
         self._user_signals = bitarray(len(self._signals))
         self._user_signals.setall(True)
         self._user_signals &= ~self._comb_signals
@@ -593,19 +1321,83 @@ class Simulator:
 
         return self
 
+    def _order_comb_signals(self, hierarchy):
+        """Order signals such that every combinatorial signal comes after the signals it depends
+        on, and warn about every combinatorial loop that makes this impossible."""
+        successors = [[] for _ in self._slot_signals] # int/slot -> [int/slot]
+        scopes = dict() # int/slot -> (str/name)
+
+        def add_dependencies(stmts, comb_signals, test_signals):
+            for stmt in stmts:
+                if isinstance(stmt, Assign):
+                    lhs_signals = [signal for signal in stmt.lhs._lhs_signals()
+                                   if signal in comb_signals]
+                    if not lhs_signals:
+                        continue
+                    # A partial assignment reads the signal it assigns, but does not depend on it,
+                    # and neither does an assignment that holds its value, like a latch.
+                    rhs_signals = test_signals | (stmt.lhs._rhs_signals() -
+                                                  stmt.lhs._lhs_signals())
+                    if stmt.rhs is not stmt.lhs:
+                        rhs_signals |= stmt.rhs._rhs_signals()
+                    for rhs_signal in rhs_signals:
+                        if rhs_signal not in self._signal_slots:
+                            continue
+                        rhs_successors = successors[self._signal_slots[rhs_signal]]
+                        for lhs_signal in lhs_signals:
+                            rhs_successors.append(self._signal_slots[lhs_signal])
+                elif isinstance(stmt, Switch):
+                    case_test_signals = test_signals | stmt.test._rhs_signals()
+                    for case_stmts in stmt.cases.values():
+                        add_dependencies(case_stmts, comb_signals, case_test_signals)
+
+        for fragment, fragment_scope in hierarchy.items():
+            comb_signals = SignalSet(fragment.iter_comb())
+            if comb_signals:
+                for signal in comb_signals:
+                    scopes[self._signal_slots[signal]] = fragment_scope
+                add_dependencies(fragment.statements, comb_signals, SignalSet())
+
+        order = [None] * len(self._slot_signals) # int/slot -> int/position
+        position = 0
+        for component in _strongly_connected_components(successors):
+            if len(component) > 1 or component[0] in successors[component[0]]:
+                loop_signals = []
+                for signal_slot in sorted(component):
+                    signal = self._slot_signals[signal_slot]
+                    loop_signal = ".".join((*scopes[signal_slot], signal.name))
+                    if signal.src_loc is not None:
+                        loop_signal += " ({}:{})".format(*signal.src_loc)
+                    loop_signals.append(loop_signal)
+                warnings.warn("Combinatorial loop detected between signals {}"
+                              .format(", ".join(loop_signals)),
+                              UserWarning)
+            for signal_slot in component:
+                order[signal_slot] = position
+                position += 1
+        return order
+
     def _update_dirty_signals(self):
         """Perform the statement part of IR processes (aka RTLIL case)."""
         # First, for all dirty signals, use sensitivity lists to determine the set of fragments
         # that need their statements to be reevaluated because the signals changed at the previous
         # delta cycle.
-        funclets = set()
+        dirty_funclets = self._dirty_funclets
         for signal_slot in self._state.flush_curr_dirty():
-            funclets.update(self._funclets[signal_slot])
+            for position in self._funclet_ranks[signal_slot]:
+                dirty_funclets[position] = True
 
         # Second, compute the values of all signals at the start of the next delta cycle, by
         # running precompiled statements.
-        for funclet in funclets:
-            funclet(self._state)
+        position = 0
+        while True:
+            try:
+                position = dirty_funclets.index(True, position)
+            except ValueError:
+                break
+            dirty_funclets[position] = False
+            self._ranked_funclets[position](self._state)
+            position += 1
 
     def _commit_signal(self, signal_slot, domains):
         """Perform the driver part of IR processes (aka RTLIL sync), for individual signals."""
@@ -616,6 +1408,16 @@ class Simulator:
         if old == new:
             return
 
+        # If any simulator processes wait until a condition that depends on this signal becomes
+        # true, reevaluate the condition.
+        if signal_slot in self._wait_slots:
+            for process in self._wait_slots[signal_slot]:
+                wait_domain, funclet, wait_slots = self._wait_until[process]
+                if funclet(self._state):
+                    self._wait_ready.add(process)
+                else:
+                    self._wait_ready.discard(process)
+
         # If the signal is a clock that triggers synchronous logic, record that fact.
         if new == 1 and self._domain_triggers[signal_slot] is not None:
             domains.add(self._domain_triggers[signal_slot])
@@ -628,8 +1430,7 @@ class Simulator:
                     var_value = signal.decoder(new).replace(" ", "_")
                 else:
                     var_value = new
-                vcd_timestamp = (self._timestamp + self._delta) / self._epsilon
-                self._vcd_writer.change(vcd_signal, vcd_timestamp, var_value)
+                self._vcd_writer.change(vcd_signal, self._timestamp, var_value)
 
     def _commit_comb_signals(self, domains):
         """Perform the comb part of IR processes (aka RTLIL always)."""
@@ -643,9 +1444,8 @@ class Simulator:
         """Perform the sync part of IR processes (aka RTLIL posedge)."""
         # At entry, `domains` contains a list of every simultaneously triggered sync update.
         while domains:
-            # Advance the timeline a bit (purely for observational purposes) and commit all of them
-            # at the same timestamp.
-            self._delta += self._epsilon
+            # Start a new delta cycle and commit all of them at the same timestamp.
+            self._delta += 1
             curr_domains, domains = domains, set()
 
             while curr_domains:
@@ -662,7 +1462,32 @@ class Simulator:
                         # because Tick() simulates an edge triggered process. Like DFFs that latch
                         # a value from the previous clock cycle, simulator processes observe signal
                         # values from the previous clock cycle on a tick, too.
-                        self._run_process(process)
+                        self._run_process(process, domain)
+
+                # Wake up any simulator processes that wait for a domain tick at which their
+                # condition is true. Like the processes above, they observe signal values from
+                # the previous clock cycle.
+                for process in [process for process in self._wait_ready
+                                if self._wait_until[process][0] == domain]:
+                    wait_domain, funclet, wait_slots = self._wait_until.pop(process)
+                    for signal_slot in wait_slots:
+                        self._wait_slots[signal_slot].remove(process)
+                        if not self._wait_slots[signal_slot]:
+                            del self._wait_slots[signal_slot]
+                    self._wait_ready.remove(process)
+                    self._suspended.remove(process)
+                    self._run_process(process, domain)
+
+                if self._replay_next is not None:
+                    self._replay_stimulus(domain)
+
+                # Advance the stream drivers and monitors, which, like the processes above,
+                # observe signal values from the previous clock cycle.
+                if domain in self._streams:
+                    for stream, slots, shape, driven_slots in self._streams[domain]:
+                        stream._tick(self._state, *slots, shape)
+                        for signal_slot in driven_slots:
+                            self._commit_signal(signal_slot, domains)
 
                 # Take the computed value (at the start of this delta cycle) of every sync signal
                 # in this domain and update the value for this delta cycle. This can trigger more
@@ -675,16 +1500,18 @@ class Simulator:
             # can happen e.g. if a domain is clocked off a clock divisor in fabric), we're done.
             # Otherwise, do one more round of updates.
 
-    def _run_process(self, process):
+    def _run_process(self, process, wake_domain=None):
         try:
             cmd = process.send(None)
             while True:
                 if type(cmd) is Delay:
                     if cmd.interval is None:
-                        interval = self._epsilon
+                        interval = 1
                     else:
-                        interval = cmd.interval
-                    self._wait_deadline[process] = self._timestamp + interval
+                        interval = self._to_units(cmd.interval)
+                    heapq.heappush(self._wait_deadline,
+                                   (self._timestamp + interval, self._wait_order, process))
+                    self._wait_order += 1
                     self._suspended.add(process)
                     break
 
@@ -693,6 +1520,26 @@ class Simulator:
                     self._suspended.add(process)
                     break
 
+                elif type(cmd) is WaitUntil:
+                    if cmd.expr not in self._wait_funclets:
+                        sensitivity = SignalSet()
+                        compiler = _RHSValueCompiler(self._signal_slots, sensitivity)
+                        self._wait_funclets[cmd.expr] = \
+                            (compiler(cmd.expr), [self._signal_slots[signal]
+                                                  for signal in sensitivity
+                                                  if signal in self._signal_slots])
+                    funclet, wait_slots = self._wait_funclets[cmd.expr]
+                    if funclet(self._state):
+                        # The condition is already true; don't wait for it to become true.
+                        cmd = process.send(None)
+                        continue
+
+                    self._wait_until[process] = (cmd.domain, funclet, wait_slots)
+                    for signal_slot in wait_slots:
+                        self._wait_slots.setdefault(signal_slot, set()).add(process)
+                    self._suspended.add(process)
+                    break
+
                 elif type(cmd) is Passive:
                     self._passive.add(process)
 
@@ -719,6 +1566,12 @@ class Simulator:
                         funclet = compiler(cmd)
                         funclet(self._state)
 
+                    if self._stimulus_log:
+                        for signal in lhs_signals:
+                            signal_slot = self._signal_slots[signal]
+                            self._stimulus_log(_StimulusLog.WRITE, self._timestamp, wake_domain,
+                                               signal_slot, self._state.next[signal_slot])
+
                     domains = set()
                     for signal in lhs_signals:
                         self._commit_signal(self._signal_slots[signal], domains)
@@ -726,10 +1579,21 @@ class Simulator:
 
                 elif type(cmd) is Signal:
                     # Fast path.
-                    cmd = process.send(self._state.curr[self._signal_slots[cmd]])
+                    signal_slot = self._signal_slots[cmd]
+                    if self._stimulus_log:
+                        self._stimulus_log(_StimulusLog.READ, self._timestamp, wake_domain,
+                                           signal_slot, self._state.curr[signal_slot])
+                    cmd = process.send(self._state.curr[signal_slot])
                     continue
 
                 elif isinstance(cmd, Value):
+                    if self._stimulus_log:
+                        for signal in cmd._rhs_signals():
+                            if signal in self._signal_slots:
+                                signal_slot = self._signal_slots[signal]
+                                self._stimulus_log(_StimulusLog.READ, self._timestamp,
+                                                   wake_domain, signal_slot,
+                                                   self._state.curr[signal_slot])
                     compiler = _RHSValueCompiler(self._signal_slots)
                     funclet = compiler(cmd)
                     cmd = process.send(funclet(self._state))
@@ -752,11 +1616,10 @@ class Simulator:
         # Are there any delta cycles we should run?
         if self._state.curr_dirty.any():
             # We might run some delta cycles, and we have simulator processes waiting on
-            # a deadline. Take care to not exceed the closest deadline.
-            if self._wait_deadline and \
-                    (self._timestamp + self._delta) >= min(self._wait_deadline.values()):
+            # a deadline. Take care to not run them forever.
+            if self._wait_deadline and self._delta >= self._delta_limit:
                 # Oops, we blew the deadline. We *could* run the processes now, but this is
-                # virtually certainly a logic loop and a design bug, so bail out instead.d
+                # virtually certainly a logic loop and a design bug, so bail out instead.
                 raise DeadlineError("Delta cycles exceeded process deadline; combinatorial loop?")
 
             domains = set()
@@ -773,16 +1636,29 @@ class Simulator:
             self._run_process(process)
             return True
 
-        # All processes are suspended. Are any of them active?
-        if len(self._processes) > len(self._passive) or run_passive:
+        # All processes are suspended. Are any of them, or any of the streams, active?
+        if (len(self._processes) > len(self._passive) or run_passive or
+                self._replay_next is not None or
+                any(stream.busy for streams in self._streams.values()
+                                for stream, *_ in streams)):
+            # Is there any recorded stimulus to replay before the next deadline?
+            if self._replay_next is not None:
+                kind, timestamp, replay_domain, *_ = self._replay_next
+                if replay_domain is None and (not self._wait_deadline or
+                        timestamp <= self._wait_deadline[0][0]):
+                    self._timestamp = timestamp
+                    self._delta = 0
+                    self._replay_stimulus(None)
+                    return True
+
             # Are any of them suspended before a deadline?
             if self._wait_deadline:
-                # Schedule the one with the lowest deadline.
-                process, deadline = min(self._wait_deadline.items(), key=lambda x: x[1])
-                del self._wait_deadline[process]
+                # Schedule the one with the lowest deadline; if several processes have the same
+                # deadline, schedule the one that started waiting first.
+                deadline, _, process = heapq.heappop(self._wait_deadline)
                 self._suspended.remove(process)
                 self._timestamp = deadline
-                self._delta = 0.
+                self._delta = 0
                 self._run_process(process)
                 return True
 
@@ -798,6 +1674,7 @@ class Simulator:
     def run_until(self, deadline, run_passive=False):
         self._run_called = True
 
+        deadline = self._to_units(deadline)
         while self._timestamp < deadline:
             if not self.step(run_passive):
                 return False
@@ -808,9 +1685,11 @@ class Simulator:
         if not self._run_called:
             warnings.warn("Simulation created, but not run", UserWarning)
 
+        if self._stimulus_log:
+            self._stimulus_log(_StimulusLog.END, self._timestamp, None)
+
         if self._vcd_writer:
-            vcd_timestamp = (self._timestamp + self._delta) / self._epsilon
-            self._vcd_writer.close(vcd_timestamp)
+            self._vcd_writer.close(self._timestamp)
 
         if self._vcd_file and self._gtkw_file:
             gtkw_save = GTKWSave(self._gtkw_file)
@@ -820,7 +1699,7 @@ class Simulator:
                 gtkw_save.dumpfile_size(self._vcd_file.tell())
 
             gtkw_save.treeopen("top")
-            gtkw_save.zoom_markers(math.log(self._epsilon / self._fastest_clock) - 14)
+            gtkw_save.zoom_markers(math.log(1 / (self._fastest_clock or 1)) - 14)
 
             def add_trace(signal, **kwargs):
                 signal_slot = self._signal_slots[signal]
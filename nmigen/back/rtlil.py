@@ -216,6 +216,8 @@ class _SyncBuilder:
 
 
 def src(src_loc):
+    if src_loc is None:
+        return ""
     file, line = src_loc
     return "{}:{}".format(file, line)
 
@@ -235,6 +237,7 @@ class _ValueCompilerState:
         self.anys   = ast.ValueDict()
 
         self.expansions = ast.ValueDict()
+        self.operators  = dict() # id(Operator) -> (Operator, str/sigspec)
 
     def add_driven(self, signal, sync):
         self.driven[signal] = sync
@@ -372,6 +375,24 @@ class _RHSValueCompiler(_ValueCompiler):
         (3, "m"):    "$mux",
     }
 
+    def __init__(self, state):
+        super().__init__(state)
+        self._in_call = False
+
+    def __call__(self, value):
+        # Emit the operators of the expression first, using an explicit stack, so that
+        # the recursion in the methods below stops at the operators that were already emitted.
+        # Operators are only reused when legalization is not substituting operands.
+        if not self._in_call and not self.s.expansions:
+            self._in_call = True
+            try:
+                for operand in ast._iter_postorder(value):
+                    if type(operand) is ast.Operator:
+                        self.on_value(operand)
+            finally:
+                self._in_call = False
+        return self.on_value(value)
+
     def on_value(self, value):
         return super().on_value(self.s.expand(value))
 
@@ -495,16 +516,26 @@ class _RHSValueCompiler(_ValueCompiler):
         return res
 
     def on_Operator(self, value):
+        # An operator that is shared between several expressions (e.g. because it was created
+        # with ast.interned_values()) only needs to be emitted once, unless legalization is
+        # substituting some of its operands.
+        if not self.s.expansions and id(value) in self.s.operators:
+            return self.s.operators[id(value)][1]
+
         if len(value.operands) == 1:
-            return self.on_Operator_unary(value)
+            sigspec = self.on_Operator_unary(value)
         elif len(value.operands) == 2:
-            return self.on_Operator_binary(value)
+            sigspec = self.on_Operator_binary(value)
         elif len(value.operands) == 3:
             assert value.op == "m"
-            return self.on_Operator_mux(value)
+            sigspec = self.on_Operator_mux(value)
         else:
             raise TypeError # :nocov:
 
+        if not self.s.expansions:
+            self.s.operators[id(value)] = (value, sigspec)
+        return sigspec
+
     def _prepare_value_for_Slice(self, value):
         if isinstance(value, (ast.Signal, ast.Slice, ast.Cat)):
             sigspec = self(value)
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+
+
+__all__ = ["diff"]
+
+
+_TIMESCALE_UNITS = {"s": 10 ** 15, "ms": 10 ** 12, "us": 10 ** 9, "ns": 10 ** 6, "ps": 10 ** 3,
+                    "fs": 1}
+
+
+def _normalize_value(value):
+    # Vectors are written without leading zeroes by some tools and with them by others; compare
+    # them by value when they have one.
+    if value[0] in "bB":
+        bits = value[1:].lower()
+        if bits.strip("01") == "":
+            return int(bits, 2)
+        return bits.lstrip("0") or "0"
+    elif value[0] in "sSrR":
+        return value[1:]
+    elif value[0] in "01":
+        return int(value)
+    else:
+        return value.lower()
+
+
+class _VCDReader:
+    """Streaming reader for the subset of VCD written by :class:`Simulator`.
+
+    Only the header is kept in memory; value changes are produced one timestamp at a time.
+    """
+    def __init__(self, file):
+        self._tokens   = (token for line in file for token in line.split())
+        self.timescale = 1          # fs per VCD time unit
+        self.names     = dict()     # str/id -> [str/name]
+        self._parse_header()
+
+    def _expect_end(self):
+        tokens = []
+        for token in self._tokens:
+            if token == "$end":
+                return tokens
+            tokens.append(token)
+        raise ValueError("Malformed VCD file: unterminated command")
+
+    def _parse_header(self):
+        scope = []
+        for token in self._tokens:
+            if token == "$scope":
+                scope_type, scope_name = self._expect_end()[:2]
+                scope.append(scope_name)
+            elif token == "$upscope":
+                self._expect_end()
+                scope.pop()
+            elif token == "$var":
+                var_type, var_size, var_id, var_name, *_ = self._expect_end()
+                self.names.setdefault(var_id, []).append(".".join((*scope, var_name)))
+            elif token == "$timescale":
+                timescale = "".join(self._expect_end())
+                magnitude = timescale.rstrip("fpnums")
+                unit = timescale[len(magnitude):]
+                if unit not in _TIMESCALE_UNITS:
+                    raise ValueError("Malformed VCD file: unknown timescale '{}'"
+                                     .format(timescale))
+                self.timescale = int(magnitude) * _TIMESCALE_UNITS[unit]
+            elif token == "$enddefinitions":
+                self._expect_end()
+                return
+            elif token.startswith("$"):
+                self._expect_end()
+            else:
+                raise ValueError("Malformed VCD file: unexpected '{}' in header".format(token))
+        raise ValueError("Malformed VCD file: no $enddefinitions")
+
+    def __iter__(self):
+        timestamp = 0
+        changes   = []
+        for token in self._tokens:
+            if token.startswith("#"):
+                if changes:
+                    yield timestamp, changes
+                    changes = []
+                timestamp = int(token[1:]) * self.timescale
+            elif token[0] in "bBrRsS":
+                changes.append((next(self._tokens), _normalize_value(token)))
+            elif token[0] in "01xXzZ":
+                changes.append((token[1:], _normalize_value(token[0])))
+            elif token in ("$dumpvars", "$dumpall", "$dumpon", "$dumpoff", "$end"):
+                pass
+            elif token.startswith("$"):
+                self._expect_end()
+            else:
+                raise ValueError("Malformed VCD file: unexpected '{}'".format(token))
+        if changes:
+            yield timestamp, changes
+
+
+def diff(file_a, file_b, limit=10):
+    """Compare two VCD files signal by signal.
+
+    Signals are matched by their hierarchical names, and their values are compared at every
+    timestamp at which either of them changes. Both files are read incrementally, so traces
+    larger than memory can be compared.
+
+    Returns an ordered dict mapping the name of every signal that differs to a list of at most
+    ``limit`` tuples ``(timestamp, value_a, value_b)``, in order of time. Timestamps are in
+    femtoseconds. A signal that is present in only one of the files has a single divergence
+    at time 0, with ``None`` as the missing value.
+    """
+    reader_a = _VCDReader(file_a)
+    reader_b = _VCDReader(file_b)
+
+    names_a = {name for names in reader_a.names.values() for name in names}
+    names_b = {name for names in reader_b.names.values() for name in names}
+    divergences = OrderedDict()
+    for name in sorted(names_a - names_b):
+        divergences[name] = [(0, "x", None)]
+    for name in sorted(names_b - names_a):
+        divergences[name] = [(0, None, "x")]
+    common = names_a & names_b
+    pending = len(common)
+
+    values_a = {name: "x" for name in common}
+    values_b = {name: "x" for name in common}
+    steps_a  = iter(reader_a)
+    steps_b  = iter(reader_b)
+    step_a   = next(steps_a, None)
+    step_b   = next(steps_b, None)
+    while (step_a is not None or step_b is not None) and pending:
+        if step_b is None or step_a is not None and step_a[0] <= step_b[0]:
+            timestamp = step_a[0]
+        else:
+            timestamp = step_b[0]
+
+        changed = set()
+        if step_a is not None and step_a[0] == timestamp:
+            for var_id, value in step_a[1]:
+                for name in reader_a.names.get(var_id, ()):
+                    if name in values_a:
+                        values_a[name] = value
+                        changed.add(name)
+            step_a = next(steps_a, None)
+        if step_b is not None and step_b[0] == timestamp:
+            for var_id, value in step_b[1]:
+                for name in reader_b.names.get(var_id, ()):
+                    if name in values_b:
+                        values_b[name] = value
+                        changed.add(name)
+            step_b = next(steps_b, None)
+
+        for name in sorted(changed):
+            if values_a[name] != values_b[name]:
+                name_divergences = divergences.setdefault(name, [])
+                if len(name_divergences) < limit:
+                    name_divergences.append((timestamp, values_a[name], values_b[name]))
+                    if len(name_divergences) == limit:
+                        pending -= 1
+
+    return divergences
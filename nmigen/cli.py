@@ -1,7 +1,7 @@
 import argparse
 
 from .hdl.ir import Fragment
-from .back import rtlil, verilog, pysim
+from .back import rtlil, verilog, pysim, vcddiff
 
 
 __all__ = ["main"]
@@ -38,6 +38,18 @@ def main_parser(parser=None):
         metavar="COUNT", type=int, required=True,
         help="simulate for COUNT 'sync' clock periods")
 
+    p_diff = p_action.add_parser(
+        "diff", help="compare two execution traces")
+    p_diff.add_argument("-n", "--limit",
+        metavar="COUNT", type=int, default=10,
+        help="report at most COUNT differences per signal (default: %(default)s)")
+    p_diff.add_argument("vcd_file_a",
+        metavar="VCD-FILE-A", type=argparse.FileType("r"),
+        help="read the first execution trace from VCD-FILE-A")
+    p_diff.add_argument("vcd_file_b",
+        metavar="VCD-FILE-B", type=argparse.FileType("r"),
+        help="read the second execution trace from VCD-FILE-B")
+
     return parser
 
 
@@ -70,6 +82,14 @@ def main_runner(parser, args, design, platform=None, name="top", ports=()):
             sim.add_clock(args.sync_period)
             sim.run_until(args.sync_period * args.sync_clocks, run_passive=True)
 
+    if args.action == "diff":
+        divergences = vcddiff.diff(args.vcd_file_a, args.vcd_file_b, limit=args.limit)
+        for name, name_divergences in divergences.items():
+            for timestamp, value_a, value_b in name_divergences:
+                print("{}: at {} fs: {} != {}".format(name, timestamp, value_a, value_b))
+        if divergences:
+            parser.exit(1)
+
 
 def main(*args, **kwargs):
     parser = main_parser()
@@ -65,11 +65,13 @@ class If(ast.Switch):
         self.cases = OrderedDict(("-" + k, v) for k, v in self.cases.items())
         self.cases["1" + "-" * len(self.test)] = ast.Statement.wrap(stmts)
         self.test = Cat(self.test, cond)
+        self._lhs_signals_cache = self._rhs_signals_cache = None
         return self
 
     @deprecated("instead of `.Else(...)`, use `with m.Else(): ...`")
     def Else(self, *stmts):
         self.cases["-" * len(self.test)] = ast.Statement.wrap(stmts)
+        self._lhs_signals_cache = self._rhs_signals_cache = None
         return self
 
 
@@ -1,6 +1,8 @@
 from abc import ABCMeta, abstractmethod
 import builtins
+import functools
 import traceback
+from contextlib import contextmanager
 from collections import OrderedDict
 from collections.abc import Iterable, MutableMapping, MutableSet, MutableSequence
 
@@ -15,20 +17,154 @@ __all__ = [
     "Signal", "ClockSignal", "ResetSignal",
     "UserValue",
     "Statement", "Assign", "Assert", "Assume", "Switch", "Delay", "Tick",
-    "Passive", "ValueKey", "ValueDict", "ValueSet", "SignalKey", "SignalDict",
-    "SignalSet",
+    "WaitUntil", "Passive", "ValueKey", "ValueDict", "ValueSet", "SignalKey", "SignalDict",
+    "SignalSet", "interned_values",
 ]
 
 
 class DUID:
     """Deterministic Unique IDentifier"""
+    __slots__ = ()
     __next_uid = 0
     def __init__(self):
         self.duid = DUID.__next_uid
         DUID.__next_uid += 1
 
+    @staticmethod
+    def _allocate(count):
+        first = DUID.__next_uid
+        DUID.__next_uid += count
+        return range(first, first + count)
+
+
+_interned = None # (type, ...) -> Value
+
+
+class _InternedValueMeta(ABCMeta):
+    # Only has a `__call__` method while `interned_values()` is active, so that constructing
+    # values outside of it does not go through any Python code.
+    pass
+
+
+def _intern_value(cls, *args, **kwargs):
+    if cls is not Const:
+        # This function adds a frame between the caller and the constructor.
+        kwargs["src_loc_at"] = kwargs.get("src_loc_at", 0) + 1
+    value = ABCMeta.__call__(cls, *args, **kwargs)
+    return _interned.setdefault(value._intern_key(), value)
+
+
+@contextmanager
+def interned_values():
+    """Share structurally identical values.
+
+    Within this context, creating a ``Const``, ``Operator``, ``Slice`` or ``Cat`` that is
+    identical to one created earlier in the same context returns the earlier object. Operands are
+    compared by identity, so expressions built from shared operands are shared as well. Since
+    transformers rebuild the expressions they rewrite, conversion and simulation should happen
+    within the same context for the back-ends to see the shared nodes.
+
+    A shared value keeps the source location of the place where it was first created.
+    """
+    global _interned
+    outer = _interned
+    if _interned is None:
+        _interned = dict()
+        _InternedValueMeta.__call__ = _intern_value
+    try:
+        yield
+    finally:
+        _interned = outer
+        if _interned is None:
+            del _InternedValueMeta.__call__
+
+
+def _value_operands(value):
+    # Elements of an array are not included, since back-ends only visit the ones selected by
+    # a constant index.
+    if type(value) is Operator:
+        return value.operands
+    elif type(value) in (Slice, Repl):
+        return (value.value,)
+    elif type(value) is Part:
+        return (value.value, value.offset)
+    elif isinstance(value, Cat):
+        return value.parts
+    else:
+        return ()
+
+
+def _iter_postorder(value, operands=_value_operands):
+    """Iterate over a value and all of its operands, each operand before the values using it.
+
+    The traversal uses an explicit stack, so expressions of any depth can be visited. Operands that
+    are shared between several values are only produced once.
+    """
+    seen  = set()
+    stack = [(value, False)]
+    while stack:
+        value, expanded = stack.pop()
+        if expanded:
+            yield value
+        elif id(value) not in seen:
+            seen.add(id(value))
+            stack.append((value, True))
+            stack.extend((operand, False) for operand in reversed(operands(value)))
+
+
+def _precompute(value, method, is_cached):
+    # Call `method` on the operands of `value`, each operand before the values using it, so that
+    # computing a cached property of a deep expression does not recurse any deeper than
+    # the operands, whose results are cached by then.
+    operands = lambda operand: () if is_cached(operand) else _value_operands(operand)
+    for operand in _iter_postorder(value, operands):
+        if operand is not value:
+            method(operand)
+
+
+# Shapes of composite values are cached, which is only valid as long as the shapes of all signals
+# stay the same. Signal shapes are almost never changed after construction (the FSM state
+# signal is an exception), so every such change simply invalidates all cached shapes.
+_shape_epoch = 0
+
+
+def _shape_is_cached(value):
+    cache = value._shape_cache
+    return cache is not None and cache[0] == _shape_epoch
+
+
+def _memoize_shape(shape):
+    @functools.wraps(shape)
+    def wrapper(self):
+        if not _shape_is_cached(self):
+            _precompute(self, lambda operand: operand.shape(), _shape_is_cached)
+            self._shape_cache = (_shape_epoch, shape(self))
+        return self._shape_cache[1]
+    return wrapper
+
+
+def _memoize_signals(attr, precompute=False):
+    # Values and statements are not mutated after construction, so the sets of signals they use
+    # are computed once. The cached set is returned to every caller, which must not mutate it.
+    def decorator(signals):
+        @functools.wraps(signals)
+        def wrapper(self):
+            result = getattr(self, attr)
+            if result is None:
+                if precompute:
+                    _precompute(self, lambda operand: getattr(operand, signals.__name__)(),
+                                lambda operand: getattr(operand, attr) is not None)
+                result = signals(self)
+                setattr(self, attr, result)
+            return result
+        return wrapper
+    return decorator
+
 
 class Value(metaclass=ABCMeta):
+    __slots__ = ("src_loc", "_structural_hash", "_shape_cache",
+                 "_lhs_signals_cache", "_rhs_signals_cache")
+
     @staticmethod
     def wrap(obj):
         """Ensures that the passed object is an nMigen value. Booleans and integers
@@ -43,6 +179,10 @@ class Value(metaclass=ABCMeta):
     def __init__(self, src_loc_at=0):
         super().__init__()
         self.src_loc = tracer.get_src_loc(1 + src_loc_at)
+        self._structural_hash = None
+        self._shape_cache = None
+        self._lhs_signals_cache = None
+        self._rhs_signals_cache = None
 
     def __bool__(self):
         raise TypeError("Attempted to convert nMigen value to boolean")
@@ -212,7 +352,7 @@ class Value(metaclass=ABCMeta):
 
 
 @final
-class Const(Value):
+class Const(Value, metaclass=_InternedValueMeta):
     """A constant, literal integer value.
 
     Parameters
@@ -229,7 +369,7 @@ class Const(Value):
     nbits : int
     signed : bool
     """
-    src_loc = None
+    __slots__ = ("value", "nbits", "signed")
 
     @staticmethod
     def normalize(value, shape):
@@ -240,7 +380,30 @@ class Const(Value):
             value |= ~mask
         return value
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def normalizer(shape):
+        """Return a function equivalent to ``lambda value: Const.normalize(value, shape)``.
+
+        The masks are computed once per shape, which makes the returned function suitable
+        for evaluating many values of the same shape, as simulators do.
+        """
+        nbits, signed = shape
+        mask = (1 << nbits) - 1
+        if nbits == 0:
+            return lambda value: 0
+        elif not signed:
+            return lambda value: value & mask
+        else:
+            sign = 1 << (nbits - 1)
+            return lambda value: ((value & mask) ^ sign) - sign
+
     def __init__(self, value, shape=None):
+        self.src_loc = None
+        self._structural_hash = None
+        self._shape_cache = None
+        self._lhs_signals_cache = None
+        self._rhs_signals_cache = None
         self.value = int(value)
         if shape is None:
             shape = bits_for(self.value), self.value < 0
@@ -252,6 +415,9 @@ class Const(Value):
                             .format(self.nbits))
         self.value = self.normalize(self.value, shape)
 
+    def _intern_key(self):
+        return (Const, self.value, self.nbits, self.signed)
+
     def shape(self):
         return self.nbits, self.signed
 
@@ -269,6 +435,8 @@ C = Const  # shorthand
 
 
 class AnyValue(Value, DUID):
+    __slots__ = ("duid", "nbits", "signed")
+
     def __init__(self, shape):
         super().__init__(src_loc_at=0)
         if isinstance(shape, int):
@@ -287,23 +455,32 @@ class AnyValue(Value, DUID):
 
 @final
 class AnyConst(AnyValue):
+    __slots__ = ()
+
     def __repr__(self):
         return "(anyconst {}'{})".format(self.nbits, "s" if self.signed else "")
 
 
 @final
 class AnySeq(AnyValue):
+    __slots__ = ()
+
     def __repr__(self):
         return "(anyseq {}'{})".format(self.nbits, "s" if self.signed else "")
 
 
 @final
-class Operator(Value):
+class Operator(Value, metaclass=_InternedValueMeta):
+    __slots__ = ("op", "operands")
+
     def __init__(self, op, operands, src_loc_at=0):
         super().__init__(src_loc_at=1 + src_loc_at)
         self.op = op
         self.operands = [Value.wrap(o) for o in operands]
 
+    def _intern_key(self):
+        return (Operator, self.op, tuple(map(id, self.operands)))
+
     @staticmethod
     def _bitwise_binary_shape(a_shape, b_shape):
         a_bits, a_sign = a_shape
@@ -321,6 +498,7 @@ class Operator(Value):
             # first signed, second operand unsigned (add sign bit)
             return max(a_bits, b_bits + 1), True
 
+    @_memoize_shape
     def shape(self):
         op_shapes = list(map(lambda x: x.shape(), self.operands))
         if len(op_shapes) == 1:
@@ -366,8 +544,9 @@ class Operator(Value):
         raise NotImplementedError("Operator {}/{} not implemented"
                                   .format(self.op, len(op_shapes))) # :nocov:
 
+    @_memoize_signals("_rhs_signals_cache", precompute=True)
     def _rhs_signals(self):
-        return union(op._rhs_signals() for op in self.operands)
+        return union((op._rhs_signals() for op in self.operands), start=SignalSet())
 
     def __repr__(self):
         return "({} {})".format(self.op, " ".join(map(repr, self.operands)))
@@ -393,8 +572,10 @@ def Mux(sel, val1, val0):
 
 
 @final
-class Slice(Value):
-    def __init__(self, value, start, end):
+class Slice(Value, metaclass=_InternedValueMeta):
+    __slots__ = ("value", "start", "end")
+
+    def __init__(self, value, start, end, src_loc_at=0):
         if not isinstance(start, int):
             raise TypeError("Slice start must be an integer, not '{!r}'".format(start))
         if not isinstance(end, int):
@@ -412,11 +593,14 @@ class Slice(Value):
         if start > end:
             raise IndexError("Slice start {} must be less than slice end {}".format(start, end))
 
-        super().__init__()
+        super().__init__(src_loc_at=src_loc_at)
         self.value = Value.wrap(value)
         self.start = start
         self.end   = end
 
+    def _intern_key(self):
+        return (Slice, id(self.value), self.start, self.end)
+
     def shape(self):
         return self.end - self.start, False
 
@@ -432,6 +616,8 @@ class Slice(Value):
 
 @final
 class Part(Value):
+    __slots__ = ("value", "offset", "width")
+
     def __init__(self, value, offset, width):
         if not isinstance(width, int) or width < 0:
             raise TypeError("Part width must be a non-negative integer, not '{!r}'".format(width))
@@ -447,6 +633,7 @@ class Part(Value):
     def _lhs_signals(self):
         return self.value._lhs_signals()
 
+    @_memoize_signals("_rhs_signals_cache", precompute=True)
     def _rhs_signals(self):
         return self.value._rhs_signals() | self.offset._rhs_signals()
 
@@ -455,7 +642,7 @@ class Part(Value):
 
 
 @final
-class Cat(Value):
+class Cat(Value, metaclass=_InternedValueMeta):
     """Concatenate values.
 
     Form a compound ``Value`` from several smaller ones by concatenation.
@@ -479,16 +666,24 @@ class Cat(Value):
     Value, inout
         Resulting ``Value`` obtained by concatentation.
     """
-    def __init__(self, *args):
-        super().__init__()
+    __slots__ = ("parts",)
+
+    def __init__(self, *args, src_loc_at=0):
+        super().__init__(src_loc_at=src_loc_at)
         self.parts = [Value.wrap(v) for v in flatten(args)]
 
+    def _intern_key(self):
+        return (Cat, tuple(map(id, self.parts)))
+
+    @_memoize_shape
     def shape(self):
         return sum(len(part) for part in self.parts), False
 
+    @_memoize_signals("_lhs_signals_cache")
     def _lhs_signals(self):
         return union((part._lhs_signals() for part in self.parts), start=ValueSet())
 
+    @_memoize_signals("_rhs_signals_cache", precompute=True)
     def _rhs_signals(self):
         return union((part._rhs_signals() for part in self.parts), start=ValueSet())
 
@@ -524,6 +719,8 @@ class Repl(Value):
     Repl, out
         Replicated value.
     """
+    __slots__ = ("value", "count")
+
     def __init__(self, value, count):
         if not isinstance(count, int) or count < 0:
             raise TypeError("Replication count must be a non-negative integer, not '{!r}'"
@@ -533,6 +730,7 @@ class Repl(Value):
         self.value = Value.wrap(value)
         self.count = count
 
+    @_memoize_shape
     def shape(self):
         return len(self.value) * self.count, False
 
@@ -588,6 +786,7 @@ class Signal(Value, DUID):
     reset_less : bool
     attrs : dict
     """
+    __slots__ = ("duid", "name", "_nbits", "_signed", "reset", "reset_less", "_attrs", "decoder")
 
     def __init__(self, shape=None, name=None, reset=0, reset_less=False, min=None, max=None,
                  attrs=None, decoder=None, src_loc_at=0):
@@ -606,29 +805,61 @@ class Signal(Value, DUID):
             if min > max:
                 raise ValueError("Lower bound {} should be less or equal to higher bound {}"
                                  .format(min, max + 1))
-            self.signed = min < 0 or max < 0
+            self._signed = min < 0 or max < 0
             if min == max:
-                self.nbits = 0
+                self._nbits = 0
             else:
-                self.nbits = builtins.max(bits_for(min, self.signed),
-                                          bits_for(max, self.signed))
+                self._nbits = builtins.max(bits_for(min, self._signed),
+                                           bits_for(max, self._signed))
 
         else:
             if not (min is None and max is None):
                 raise ValueError("Only one of bits/signedness or bounds may be specified")
             if isinstance(shape, int):
-                self.nbits, self.signed = shape, False
+                self._nbits, self._signed = shape, False
             else:
-                self.nbits, self.signed = shape
+                self._nbits, self._signed = shape
 
-        if not isinstance(self.nbits, int) or self.nbits < 0:
-            raise TypeError("Width must be a non-negative integer, not '{!r}'".format(self.nbits))
+        if not isinstance(self._nbits, int) or self._nbits < 0:
+            raise TypeError("Width must be a non-negative integer, not '{!r}'"
+                            .format(self._nbits))
         self.reset = int(reset)
         self.reset_less = bool(reset_less)
 
-        self.attrs = OrderedDict(() if attrs is None else attrs)
+        # Most signals have no attributes; only allocate a dictionary for those that do.
+        self._attrs = OrderedDict(attrs) if attrs else None
         self.decoder = decoder
 
+    @property
+    def nbits(self):
+        return self._nbits
+
+    @nbits.setter
+    def nbits(self, nbits):
+        global _shape_epoch
+        self._nbits = nbits
+        _shape_epoch += 1
+
+    @property
+    def signed(self):
+        return self._signed
+
+    @signed.setter
+    def signed(self, signed):
+        global _shape_epoch
+        self._signed = signed
+        _shape_epoch += 1
+
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            self._attrs = OrderedDict()
+        return self._attrs
+
+    @attrs.setter
+    def attrs(self, attrs):
+        self._attrs = attrs
+
     @classmethod
     def like(cls, other, name=None, src_loc_at=0, **kwargs):
         """Create Signal based on another.
@@ -642,12 +873,64 @@ class Signal(Value, DUID):
         kw   = dict(shape=cls.wrap(other).shape(), name=name)
         if isinstance(other, cls):
             kw.update(reset=other.reset, reset_less=other.reset_less,
-                      attrs=other.attrs, decoder=other.decoder)
+                      attrs=other._attrs, decoder=other.decoder)
         kw.update(kwargs)
         return cls(**kw, src_loc_at=1 + src_loc_at)
 
+    @classmethod
+    def bank(cls, count, shape=None, name_fmt=None, reset=0, reset_less=False, attrs=None,
+             decoder=None, src_loc_at=0):
+        """Create many Signals with the same shape at once.
+
+        The arguments are validated, and the name and source location are determined, only once
+        for the whole bank, and the Signals receive consecutive DUIDs.
+
+        Parameters
+        ----------
+        count : int
+            Number of Signals to create.
+        name_fmt : str or None
+            Format string for the name of each Signal, which is formatted with its index.
+            If ``None`` (default), the names are the variable name the bank is assigned to,
+            followed by the index in parentheses.
+
+        Other parameters are the same as for ``Signal``.
+
+        Returns
+        -------
+        list of Signal
+        """
+        if not isinstance(count, int) or count < 0:
+            raise TypeError("Signal count must be a non-negative integer, not '{!r}'"
+                            .format(count))
+        if name_fmt is not None and not isinstance(name_fmt, str):
+            raise TypeError("Name format must be a string, not '{!r}'".format(name_fmt))
+        if name_fmt is None:
+            name_fmt = tracer.get_var_name(depth=2 + src_loc_at, default="$signal") + "({})"
+        prototype = cls(shape, name=name_fmt, reset=reset, reset_less=reset_less,
+                        attrs=attrs, decoder=decoder, src_loc_at=1 + src_loc_at)
+
+        signals = []
+        for index, duid in enumerate(DUID._allocate(count)):
+            signal = object.__new__(cls)
+            signal.src_loc            = prototype.src_loc
+            signal._structural_hash   = None
+            signal._shape_cache       = None
+            signal._lhs_signals_cache = None
+            signal._rhs_signals_cache = None
+            signal.duid               = duid
+            signal.name               = name_fmt.format(index)
+            signal._nbits             = prototype._nbits
+            signal._signed            = prototype._signed
+            signal.reset              = prototype.reset
+            signal.reset_less         = prototype.reset_less
+            signal._attrs             = OrderedDict(attrs) if attrs else None
+            signal.decoder            = decoder
+            signals.append(signal)
+        return signals
+
     def shape(self):
-        return self.nbits, self.signed
+        return self._nbits, self._signed
 
     def _lhs_signals(self):
         return ValueSet((self,))
@@ -672,6 +955,8 @@ class ClockSignal(Value):
     domain : str
         Clock domain to obtain a clock signal for. Defaults to ``"sync"``.
     """
+    __slots__ = ("domain",)
+
     def __init__(self, domain="sync"):
         super().__init__()
         if not isinstance(domain, str):
@@ -706,6 +991,8 @@ class ResetSignal(Value):
     allow_reset_less : bool
         If the clock domain is reset-less, act as a constant ``0`` instead of reporting an error.
     """
+    __slots__ = ("domain", "allow_reset_less")
+
     def __init__(self, domain="sync", allow_reset_less=False):
         super().__init__()
         if not isinstance(domain, str):
@@ -792,8 +1079,13 @@ class Array(MutableSequence):
     def __len__(self):
         return len(self._inner)
 
+    def __iter__(self):
+        return iter(self._inner)
+
     def _check_mutability(self):
         if not self._mutable:
+            if self._proxy_at is None:
+                raise ValueError("Array can no longer be mutated after it was indexed with a value")
             raise ValueError("Array can no longer be mutated after it was indexed with a value "
                              "at {}:{}".format(*self._proxy_at))
 
@@ -816,6 +1108,8 @@ class Array(MutableSequence):
 
 @final
 class ArrayProxy(Value):
+    __slots__ = ("elems", "index")
+
     def __init__(self, elems, index):
         super().__init__(src_loc_at=1)
         self.elems = elems
@@ -830,6 +1124,7 @@ class ArrayProxy(Value):
     def _iter_as_values(self):
         return (Value.wrap(elem) for elem in self.elems)
 
+    @_memoize_shape
     def shape(self):
         bits, sign = 0, False
         for elem_bits, elem_sign in (elem.shape() for elem in self._iter_as_values()):
@@ -837,10 +1132,12 @@ class ArrayProxy(Value):
             sign = max(sign, elem_sign)
         return bits, sign
 
+    @_memoize_signals("_lhs_signals_cache")
     def _lhs_signals(self):
         signals = union((elem._lhs_signals() for elem in self._iter_as_values()), start=ValueSet())
         return signals
 
+    @_memoize_signals("_rhs_signals_cache")
     def _rhs_signals(self):
         signals = union((elem._rhs_signals() for elem in self._iter_as_values()), start=ValueSet())
         return self.index._rhs_signals() | signals
@@ -901,6 +1198,8 @@ class Sample(Value):
     of the ``domain`` clock back. If that moment is before the beginning of time, it is equal
     to the value of the expression calculated as if each signal had its reset value.
     """
+    __slots__ = ("value", "clocks", "domain")
+
     def __init__(self, expr, clocks, domain):
         super().__init__(src_loc_at=1)
         self.value  = Value.wrap(expr)
@@ -946,6 +1245,9 @@ class _StatementList(list):
 
 
 class Statement:
+    _lhs_signals_cache = None
+    _rhs_signals_cache = None
+
     @staticmethod
     def wrap(obj):
         if isinstance(obj, Iterable):
@@ -966,6 +1268,7 @@ class Assign(Statement):
     def _lhs_signals(self):
         return self.lhs._lhs_signals()
 
+    @_memoize_signals("_rhs_signals_cache")
     def _rhs_signals(self):
         return self.lhs._rhs_signals() | self.rhs._rhs_signals()
 
@@ -1027,11 +1330,13 @@ class Switch(Statement):
                 stmts = [stmts]
             self.cases[key] = Statement.wrap(stmts)
 
+    @_memoize_signals("_lhs_signals_cache")
     def _lhs_signals(self):
         signals = union((s._lhs_signals() for ss in self.cases.values() for s in ss),
                         start=ValueSet())
         return signals
 
+    @_memoize_signals("_rhs_signals_cache")
     def _rhs_signals(self):
         signals = union((s._rhs_signals() for ss in self.cases.values() for s in ss),
                         start=ValueSet())
@@ -1070,6 +1375,19 @@ class Tick(Statement):
         return "(tick {})".format(self.domain)
 
 
+@final
+class WaitUntil(Statement):
+    def __init__(self, expr, domain="sync"):
+        self.expr   = Value.wrap(expr)
+        self.domain = str(domain)
+
+    def _rhs_signals(self):
+        return self.expr._rhs_signals()
+
+    def __repr__(self):
+        return "(wait-until {} {!r})".format(self.domain, self.expr)
+
+
 @final
 class Passive(Statement):
     def _rhs_signals(self):
@@ -1172,35 +1490,49 @@ class ValueKey:
         self.value = Value.wrap(value)
 
     def __hash__(self):
-        if isinstance(self.value, Const):
-            return hash(self.value.value)
-        elif isinstance(self.value, (Signal, AnyValue)):
-            return hash(self.value.duid)
-        elif isinstance(self.value, (ClockSignal, ResetSignal)):
-            return hash(self.value.domain)
-        elif isinstance(self.value, Operator):
-            return hash((self.value.op, tuple(ValueKey(o) for o in self.value.operands)))
-        elif isinstance(self.value, Slice):
-            return hash((ValueKey(self.value.value), self.value.start, self.value.end))
-        elif isinstance(self.value, Part):
-            return hash((ValueKey(self.value.value), ValueKey(self.value.offset),
-                         self.value.width))
-        elif isinstance(self.value, Cat):
-            return hash(tuple(ValueKey(o) for o in self.value.parts))
-        elif isinstance(self.value, ArrayProxy):
-            return hash((ValueKey(self.value.index),
-                         tuple(ValueKey(e) for e in self.value._iter_as_values())))
-        elif isinstance(self.value, Sample):
-            return hash((ValueKey(self.value.value), self.value.clocks, self.value.domain))
+        value = self.value
+        if value._structural_hash is not None:
+            return value._structural_hash
+
+        # Values are not mutated after construction, so the hash of each node is computed once
+        # and cached on the node itself.
+        _precompute(value, lambda operand: hash(ValueKey(operand)),
+                    lambda operand: operand._structural_hash is not None)
+        if isinstance(value, Const):
+            value_hash = hash(value.value)
+        elif isinstance(value, (Signal, AnyValue)):
+            value_hash = hash(value.duid)
+        elif isinstance(value, (ClockSignal, ResetSignal)):
+            value_hash = hash(value.domain)
+        elif isinstance(value, Operator):
+            value_hash = hash((value.op, tuple(hash(ValueKey(o)) for o in value.operands)))
+        elif isinstance(value, Slice):
+            value_hash = hash((hash(ValueKey(value.value)), value.start, value.end))
+        elif isinstance(value, Part):
+            value_hash = hash((hash(ValueKey(value.value)), hash(ValueKey(value.offset)),
+                               value.width))
+        elif isinstance(value, Cat):
+            value_hash = hash(tuple(hash(ValueKey(o)) for o in value.parts))
+        elif isinstance(value, ArrayProxy):
+            value_hash = hash((hash(ValueKey(value.index)),
+                               tuple(hash(ValueKey(e)) for e in value._iter_as_values())))
+        elif isinstance(value, Sample):
+            value_hash = hash((hash(ValueKey(value.value)), value.clocks, value.domain))
         else: # :nocov:
             raise TypeError("Object '{!r}' cannot be used as a key in value collections"
-                            .format(self.value))
+                            .format(value))
+        value._structural_hash = value_hash
+        return value_hash
 
     def __eq__(self, other):
         if type(other) is not ValueKey:
             return False
+        if self.value is other.value:
+            return True
         if type(self.value) is not type(other.value):
             return False
+        if hash(self) != hash(other):
+            return False
 
         if isinstance(self.value, Const):
             return self.value.value == other.value.value
@@ -1222,8 +1554,9 @@ class ValueKey:
                     ValueKey(self.value.offset) == ValueKey(other.value.offset) and
                     self.value.width == other.value.width)
         elif isinstance(self.value, Cat):
-            return all(ValueKey(a) == ValueKey(b)
-                        for a, b in zip(self.value.parts, other.value.parts))
+            return (len(self.value.parts) == len(other.value.parts) and
+                    all(ValueKey(a) == ValueKey(b)
+                        for a, b in zip(self.value.parts, other.value.parts)))
         elif isinstance(self.value, ArrayProxy):
             return (ValueKey(self.value.index) == ValueKey(other.value.index) and
                     len(self.value.elems) == len(other.value.elems) and
@@ -1233,7 +1566,7 @@ class ValueKey:
         elif isinstance(self.value, Sample):
             return (ValueKey(self.value.value) == ValueKey(other.value.value) and
                     self.value.clocks == other.value.clocks and
-                    self.value.domain == self.value.domain)
+                    self.value.domain == other.value.domain)
         else: # :nocov:
             raise TypeError("Object '{!r}' cannot be used as a key in value collections"
                             .format(self.value))
@@ -1298,11 +1631,88 @@ class SignalKey:
         return "<{}.SignalKey {!r}>".format(__name__, self.signal)
 
 
-class SignalDict(_MappedKeyDict):
-    _map_key   = SignalKey
-    _unmap_key = lambda self, key: key.signal
+def _signal_key(signal):
+    # Same identity as SignalKey, but without allocating a wrapper: a signal is identified by its
+    # DUID, and a clock or reset signal by its domain.
+    if type(signal) is Signal:
+        return signal.duid
+    elif type(signal) is ClockSignal:
+        return (1, signal.domain)
+    elif type(signal) is ResetSignal:
+        return (2, signal.domain)
+    else:
+        raise TypeError("Object '{!r}' is not an nMigen signal".format(signal))
+
+
+class SignalDict(MutableMapping):
+    def __init__(self, pairs=()):
+        self._storage = OrderedDict() # key -> value
+        self._signals = dict()        # key -> Signal
+        for key, value in pairs:
+            self[key] = value
+
+    def __getitem__(self, signal):
+        return self._storage[None if signal is None else _signal_key(signal)]
+
+    def __setitem__(self, signal, value):
+        key = None if signal is None else _signal_key(signal)
+        self._storage[key] = value
+        self._signals[key] = signal
+
+    def __delitem__(self, signal):
+        key = None if signal is None else _signal_key(signal)
+        del self._storage[key]
+        del self._signals[key]
+
+    def __contains__(self, signal):
+        return (None if signal is None else _signal_key(signal)) in self._storage
+
+    def __iter__(self):
+        signals = self._signals
+        for key in self._storage:
+            yield signals[key]
+
+    def __eq__(self, other):
+        if not isinstance(other, type(self)):
+            return False
+        # Like the other value collections, the comparison does not depend on the order of keys.
+        return dict.__eq__(self._storage, other._storage)
+
+    def __len__(self):
+        return len(self._storage)
+
+    def __repr__(self):
+        pairs = ["({!r}, {!r})".format(k, v) for k, v in self.items()]
+        return "{}.{}([{}])".format(type(self).__module__, type(self).__name__,
+                                    ", ".join(pairs))
+
+
+class SignalSet(MutableSet):
+    def __init__(self, elements=()):
+        self._storage = OrderedDict() # key -> Signal
+        for elem in elements:
+            self._storage[_signal_key(elem)] = elem
+
+    def add(self, signal):
+        self._storage[_signal_key(signal)] = signal
+
+    def update(self, signals):
+        storage = self._storage
+        for signal in signals:
+            storage[_signal_key(signal)] = signal
+
+    def discard(self, signal):
+        self._storage.pop(_signal_key(signal), None)
 
+    def __contains__(self, signal):
+        return _signal_key(signal) in self._storage
 
-class SignalSet(_MappedKeySet):
-    _map_key   = SignalKey
-    _unmap_key = lambda self, key: key.signal
+    def __iter__(self):
+        return iter(list(self._storage.values()))
+
+    def __len__(self):
+        return len(self._storage)
+
+    def __repr__(self):
+        return "{}.{}({})".format(type(self).__module__, type(self).__name__,
+                                  ", ".join(repr(x) for x in self))
@@ -1,8 +1,10 @@
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 from functools import reduce
 import warnings
 import traceback
+import time
 import sys
 
 from ..tools import *
@@ -243,7 +245,10 @@ class Fragment:
                 raise DriverConflict(message)
             elif mode == "warn":
                 message += "; hierarchy will be flattened"
-                warnings.warn_explicit(message, DriverConflict, *signal.src_loc)
+                if signal.src_loc is None:
+                    warnings.warn(message, DriverConflict)
+                else:
+                    warnings.warn_explicit(message, DriverConflict, *signal.src_loc)
 
         for memory, subfrags in memory_subfrags.items():
             subfrag_names = flatten_subfrags_if_needed(subfrags)
@@ -257,7 +262,10 @@ class Fragment:
                 raise DriverConflict(message)
             elif mode == "warn":
                 message += "; hierarchy will be flattened"
-                warnings.warn_explicit(message, DriverConflict, *memory.src_loc)
+                if memory.src_loc is None:
+                    warnings.warn(message, DriverConflict)
+                else:
+                    warnings.warn_explicit(message, DriverConflict, *memory.src_loc)
 
         # Flatten hierarchy.
         for subfrag, subfrag_hierarchy in sorted(flatten_subfrags, key=lambda x: x[1]):
@@ -348,16 +356,10 @@ class Fragment:
         self._propagate_domains_down()
         return new_domains
 
-    def _insert_domain_resets(self):
-        from .xfrm import ResetInserter
-
-        resets = {cd.name: cd.rst for cd in self.domains.values() if cd.rst is not None}
-        return ResetInserter(resets)(self)
-
-    def _lower_domain_signals(self):
+    def _lower_domains(self):
         from .xfrm import DomainLowerer
 
-        return DomainLowerer(self.domains)(self)
+        return DomainLowerer(self.domains, insert_resets=True)(self)
 
     def _prepare_use_def_graph(self, parent, level, uses, defs, ios, top):
         def add_uses(*sigs, self=self):
@@ -499,23 +501,41 @@ class Fragment:
             else:
                 self.add_ports(sig, dir="i")
 
-    def prepare(self, ports=None, ensure_sync_exists=True):
+    def prepare(self, ports=None, ensure_sync_exists=True, timings=None):
+        """Prepare the fragment hierarchy for a backend.
+
+        If ``timings`` is a dict, the time in seconds taken by each pass is stored in it, keyed
+        by the name of the pass.
+        """
         from .xfrm import SampleLowerer
 
-        fragment = SampleLowerer()(self)
-        new_domains = fragment._propagate_domains(ensure_sync_exists)
-        fragment._resolve_hierarchy_conflicts()
-        fragment = fragment._insert_domain_resets()
-        fragment = fragment._lower_domain_signals()
-        if ports is None:
-            fragment._propagate_ports(ports=(), all_undef_as_ports=True)
-        else:
-            new_ports = []
-            for cd in new_domains:
-                new_ports.append(cd.clk)
-                if cd.rst is not None:
-                    new_ports.append(cd.rst)
-            fragment._propagate_ports(ports=(*ports, *new_ports), all_undef_as_ports=False)
+        if timings is None:
+            timings = {}
+
+        @contextmanager
+        def timed(name):
+            start = time.perf_counter()
+            yield
+            timings[name] = time.perf_counter() - start
+
+        with timed("lower_samples"):
+            fragment = SampleLowerer()(self)
+        with timed("propagate_domains"):
+            new_domains = fragment._propagate_domains(ensure_sync_exists)
+        with timed("resolve_hierarchy_conflicts"):
+            fragment._resolve_hierarchy_conflicts()
+        with timed("lower_domains"):
+            fragment = fragment._lower_domains()
+        with timed("propagate_ports"):
+            if ports is None:
+                fragment._propagate_ports(ports=(), all_undef_as_ports=True)
+            else:
+                new_ports = []
+                for cd in new_domains:
+                    new_ports.append(cd.clk)
+                    if cd.rst is not None:
+                        new_ports.append(cd.rst)
+                fragment._propagate_ports(ports=(*ports, *new_ports), all_undef_as_ports=False)
         return fragment
 
 
@@ -24,10 +24,11 @@ class Memory:
         self.depth = depth
 
         # Array of signals for simulation.
-        self._array = Array()
         if simulate:
-            for addr in range(self.depth):
-                self._array.append(Signal(self.width, name="{}({})".format(name, addr)))
+            name_fmt = str(name).replace("{", "{{").replace("}", "}}") + "({})"
+            self._array = Array(Signal.bank(self.depth, self.width, name_fmt=name_fmt))
+        else:
+            self._array = Array()
 
         self.init = init
 
@@ -43,11 +44,11 @@ class Memory:
                              .format(len(self.init), self.depth))
 
         try:
-            for addr in range(len(self._array)):
+            for addr, signal in enumerate(self._array):
                 if addr < len(self._init):
-                    self._array[addr].reset = operator.index(self._init[addr])
+                    signal.reset = operator.index(self._init[addr])
                 else:
-                    self._array[addr].reset = 0
+                    signal.reset = 0
         except TypeError as e:
             raise TypeError("Memory initialization value at address {:x}: {}"
                             .format(addr, e)) from None
@@ -5,6 +5,7 @@ from functools import reduce
 from .. import tracer
 from ..tools import union
 from .ast import *
+from .ast import _memoize_shape, _memoize_signals
 
 
 __all__ = ["Direction", "DIR_NONE", "DIR_FANOUT", "DIR_FANIN", "Layout", "Record"]
@@ -75,6 +76,10 @@ class Record(Value):
 
         self.name    = name
         self.src_loc = tracer.get_src_loc()
+        self._structural_hash = None
+        self._shape_cache = None
+        self._lhs_signals_cache = None
+        self._rhs_signals_cache = None
 
         def concat(a, b):
             if a is None:
@@ -114,12 +119,15 @@ class Record(Value):
         else:
             return super().__getitem__(item)
 
+    @_memoize_shape
     def shape(self):
         return sum(len(f) for f in self.fields.values()), False
 
+    @_memoize_signals("_lhs_signals_cache")
     def _lhs_signals(self):
         return union((f._lhs_signals() for f in self.fields.values()), start=SignalSet())
 
+    @_memoize_signals("_rhs_signals_cache")
     def _rhs_signals(self):
         return union((f._rhs_signals() for f in self.fields.values()), start=SignalSet())
 
@@ -1,10 +1,11 @@
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
 from collections.abc import Iterable
+from contextlib import contextmanager
 
 from ..tools import flatten
 from .ast import *
-from .ast import _StatementList
+from .ast import _StatementList, _iter_postorder
 from .cd import *
 from .ir import *
 from .rec import *
@@ -80,42 +81,43 @@ class ValueVisitor(metaclass=ABCMeta):
     def on_unknown_value(self, value):
         raise TypeError("Cannot transform value '{!r}'".format(value)) # :nocov:
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._value_methods = dict() # type -> (str, function)
+
+    @staticmethod
+    def _value_method_name(value_type):
+        if value_type in (Const, AnyConst, AnySeq, Signal, ClockSignal, ResetSignal,
+                          Operator, Slice, Part, Repl, ArrayProxy, Sample):
+            return "on_" + value_type.__name__
+        elif issubclass(value_type, Record):
+            # Uses `issubclass()` and not `is` to allow inheriting from Record.
+            return "on_Record"
+        elif issubclass(value_type, Cat):
+            # Uses `issubclass()` and not `is` because nmigen.compat requires it.
+            return "on_Cat"
+        elif issubclass(value_type, UserValue):
+            # Uses `issubclass()` and not `is` to allow inheriting.
+            return "_on_UserValue"
+        else:
+            return "on_unknown_value"
+
+    def _on_UserValue(self, value):
+        return self.on_value(value._lazy_lower())
+
     def on_value(self, value):
-        if type(value) is Const:
-            new_value = self.on_Const(value)
-        elif type(value) is AnyConst:
-            new_value = self.on_AnyConst(value)
-        elif type(value) is AnySeq:
-            new_value = self.on_AnySeq(value)
-        elif type(value) is Signal:
-            new_value = self.on_Signal(value)
-        elif isinstance(value, Record):
-            # Uses `isinstance()` and not `type() is` to allow inheriting from Record.
-            new_value = self.on_Record(value)
-        elif type(value) is ClockSignal:
-            new_value = self.on_ClockSignal(value)
-        elif type(value) is ResetSignal:
-            new_value = self.on_ResetSignal(value)
-        elif type(value) is Operator:
-            new_value = self.on_Operator(value)
-        elif type(value) is Slice:
-            new_value = self.on_Slice(value)
-        elif type(value) is Part:
-            new_value = self.on_Part(value)
-        elif isinstance(value, Cat):
-            # Uses `isinstance()` and not `type() is` because nmigen.compat requires it.
-            new_value = self.on_Cat(value)
-        elif type(value) is Repl:
-            new_value = self.on_Repl(value)
-        elif type(value) is ArrayProxy:
-            new_value = self.on_ArrayProxy(value)
-        elif type(value) is Sample:
-            new_value = self.on_Sample(value)
-        elif isinstance(value, UserValue):
-            # Uses `isinstance()` and not `type() is` to allow inheriting.
-            new_value = self.on_value(value._lazy_lower())
+        # The method that handles values of a given type is only looked up once per visitor class,
+        # but a method assigned to the visitor instance itself still takes precedence.
+        try:
+            name, method = self._value_methods[type(value)]
+        except KeyError:
+            name   = self._value_method_name(type(value))
+            method = getattr(type(self), name)
+            self._value_methods[type(value)] = name, method
+        if name in self.__dict__:
+            new_value = self.__dict__[name](value)
         else:
-            new_value = self.on_unknown_value(value)
+            new_value = method(self, value)
         if isinstance(new_value, Value):
             new_value.src_loc = value.src_loc
         return new_value
@@ -124,7 +126,118 @@ class ValueVisitor(metaclass=ABCMeta):
         return self.on_value(value)
 
 
+_transformer_rebuilders = dict() # type -> {type: (operands, rebuild)}
+
+
+def _unchanged(new_items, items):
+    return all(new_item is item for new_item, item in zip(new_items, items))
+
+
+@contextmanager
+def _value_memo_scope(transformer):
+    # Values are only memoized for the duration of a single top-level transformation, so that
+    # the memo does not keep values alive, or outlive the state the transformer has at the time.
+    if not isinstance(transformer, ValueTransformer) or transformer._value_memo is not None:
+        yield
+        return
+    transformer._value_memo = dict() # id -> (Value, Value)
+    try:
+        yield
+    finally:
+        transformer._value_memo = None
+
+
 class ValueTransformer(ValueVisitor):
+    """Value transformer.
+
+    Each value is transformed at most once during a single call of the transformer, and
+    the result is reused wherever the same value occurs again. Because of this, ``on_*`` methods
+    must be pure: the transformation of a value may not depend on where it is used, or on what
+    was transformed before it.
+    """
+
+    _value_memo = None
+
+    # Values with operands that are transformed by the default methods below, and how to build
+    # the transformed value from the transformed operands.
+    _rebuilders = OrderedDict([
+        (Operator,   (lambda value: value.operands,
+                      lambda value, ops: Operator(value.op, ops))),
+        (Slice,      (lambda value: (value.value,),
+                      lambda value, ops: Slice(ops[0], value.start, value.end))),
+        (Part,       (lambda value: (value.value, value.offset),
+                      lambda value, ops: Part(ops[0], ops[1], value.width))),
+        (Cat,        (lambda value: value.parts,
+                      lambda value, ops: Cat(ops))),
+        (Repl,       (lambda value: (value.value,),
+                      lambda value, ops: Repl(ops[0], value.count))),
+        (ArrayProxy, (lambda value: (*value.elems, value.index),
+                      lambda value, ops: ArrayProxy(ops[:-1], ops[-1]))),
+        (Sample,     (lambda value: (value.value,),
+                      lambda value, ops: Sample(ops[0], value.clocks, value.domain))),
+    ])
+
+    @classmethod
+    def _default_rebuilders(cls):
+        if cls not in _transformer_rebuilders:
+            rebuilders = dict()
+            if cls.on_value is ValueTransformer.on_value:
+                for value_type, rebuilder in cls._rebuilders.items():
+                    method_name = "on_" + value_type.__name__
+                    if getattr(cls, method_name) is getattr(ValueTransformer, method_name):
+                        rebuilders[value_type] = rebuilder
+            _transformer_rebuilders[cls] = rebuilders
+        return _transformer_rebuilders[cls]
+
+    def on_value(self, value):
+        # Expressions are DAGs, with the same value often used in many places. Each value is only
+        # transformed once, so that shared values remain shared after the transformation.
+        memo = self._value_memo
+        if memo is None:
+            with _value_memo_scope(self):
+                return self.on_value(value)
+        if id(value) in memo:
+            return memo[id(value)][1]
+
+        # Expressions may be much deeper than the Python stack. Whenever a value would be
+        # transformed by one of the default methods, which only transform the operands, this is
+        # done using an explicit stack. Any other value is dispatched as usual.
+        rebuilders = self._default_rebuilders()
+        if any(name.startswith("on_") for name in self.__dict__):
+            # Values handled by methods assigned to the instance are dispatched as usual.
+            rebuilders = {value_type: rebuilder for value_type, rebuilder in rebuilders.items()
+                          if "on_" + value_type.__name__ not in self.__dict__}
+        if type(value) not in rebuilders:
+            new_value = super().on_value(value)
+            memo[id(value)] = (value, new_value)
+            return new_value
+
+        results = []
+        stack   = [(value, None, None)]
+        while stack:
+            value, rebuild, operands = stack.pop()
+            if rebuild is not None:
+                new_operands = results[len(results) - len(operands):]
+                del results[len(results) - len(operands):]
+                if _unchanged(new_operands, operands):
+                    new_value = value
+                else:
+                    new_value = rebuild(value, new_operands)
+                    new_value.src_loc = value.src_loc
+            elif id(value) in memo:
+                new_value = memo[id(value)][1]
+            elif type(value) in rebuilders:
+                operands, rebuild = rebuilders[type(value)]
+                operands = tuple(operands(value))
+                stack.append((value, rebuild, operands))
+                stack.extend((Value.wrap(operand), None, None) for operand in reversed(operands))
+                continue
+            else:
+                new_value = super().on_value(value)
+            memo[id(value)] = (value, new_value)
+            results.append(new_value)
+        return results[0]
+
     def on_Const(self, value):
         return value
 
@@ -146,27 +259,51 @@ class ValueTransformer(ValueVisitor):
     def on_ResetSignal(self, value):
         return value
 
+    # Values whose operands are all left unchanged are returned as-is instead of being rebuilt.
+
     def on_Operator(self, value):
-        return Operator(value.op, [self.on_value(o) for o in value.operands])
+        operands = [self.on_value(o) for o in value.operands]
+        if _unchanged(operands, value.operands):
+            return value
+        return Operator(value.op, operands)
 
     def on_Slice(self, value):
-        return Slice(self.on_value(value.value), value.start, value.end)
+        new_value = self.on_value(value.value)
+        if new_value is value.value:
+            return value
+        return Slice(new_value, value.start, value.end)
 
     def on_Part(self, value):
-        return Part(self.on_value(value.value), self.on_value(value.offset), value.width)
+        new_value, new_offset = self.on_value(value.value), self.on_value(value.offset)
+        if new_value is value.value and new_offset is value.offset:
+            return value
+        return Part(new_value, new_offset, value.width)
 
     def on_Cat(self, value):
-        return Cat(self.on_value(o) for o in value.parts)
+        parts = [self.on_value(o) for o in value.parts]
+        if _unchanged(parts, value.parts):
+            return value
+        return Cat(parts)
 
     def on_Repl(self, value):
-        return Repl(self.on_value(value.value), value.count)
+        new_value = self.on_value(value.value)
+        if new_value is value.value:
+            return value
+        return Repl(new_value, value.count)
 
     def on_ArrayProxy(self, value):
-        return ArrayProxy([self.on_value(elem) for elem in value._iter_as_values()],
-                          self.on_value(value.index))
+        new_elems = [self.on_value(elem) for elem in value._iter_as_values()]
+        new_index = self.on_value(value.index)
+        # Elements that are not values yet are wrapped, and so always count as changed.
+        if _unchanged(new_elems, value.elems) and new_index is value.index:
+            return value
+        return ArrayProxy(new_elems, new_index)
 
     def on_Sample(self, value):
-        return Sample(self.on_value(value.value), value.clocks, value.domain)
+        new_value = self.on_value(value.value)
+        if new_value is value.value:
+            return value
+        return Sample(new_value, value.clocks, value.domain)
 
 
 class StatementVisitor(metaclass=ABCMeta):
@@ -193,20 +330,35 @@ class StatementVisitor(metaclass=ABCMeta):
     def on_unknown_statement(self, stmt):
         raise TypeError("Cannot transform statement '{!r}'".format(stmt)) # :nocov:
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._statement_methods = dict() # type -> (str, function)
+
+    @staticmethod
+    def _statement_method_name(stmt_type):
+        if stmt_type in (Assign, Assert, Assume):
+            return "on_" + stmt_type.__name__
+        elif issubclass(stmt_type, Switch):
+            # Uses `issubclass()` and not `is` because nmigen.compat requires it.
+            return "on_Switch"
+        elif issubclass(stmt_type, Iterable):
+            return "on_statements"
+        else:
+            return "on_unknown_statement"
+
     def on_statement(self, stmt):
-        if type(stmt) is Assign:
-            new_stmt = self.on_Assign(stmt)
-        elif type(stmt) is Assert:
-            new_stmt = self.on_Assert(stmt)
-        elif type(stmt) is Assume:
-            new_stmt = self.on_Assume(stmt)
-        elif isinstance(stmt, Switch):
-            # Uses `isinstance()` and not `type() is` because nmigen.compat requires it.
-            new_stmt = self.on_Switch(stmt)
-        elif isinstance(stmt, Iterable):
-            new_stmt = self.on_statements(stmt)
+        # The method that handles statements of a given type is only looked up once per visitor
+        # class, but a method assigned to the visitor instance itself still takes precedence.
+        try:
+            name, method = self._statement_methods[type(stmt)]
+        except KeyError:
+            name   = self._statement_method_name(type(stmt))
+            method = getattr(type(self), name)
+            self._statement_methods[type(stmt)] = name, method
+        if name in self.__dict__:
+            new_stmt = self.__dict__[name](stmt)
         else:
-            new_stmt = self.on_unknown_statement(stmt)
+            new_stmt = method(self, stmt)
         if hasattr(stmt, "src_loc") and hasattr(new_stmt, "src_loc"):
             new_stmt.src_loc = stmt.src_loc
         return new_stmt
@@ -216,24 +368,46 @@ class StatementVisitor(metaclass=ABCMeta):
 
 
 class StatementTransformer(StatementVisitor):
+    # Statements whose values and nested statements are all left unchanged are returned as-is
+    # instead of being rebuilt.
+
     def on_value(self, value):
         return value
 
     def on_Assign(self, stmt):
-        return Assign(self.on_value(stmt.lhs), self.on_value(stmt.rhs))
+        lhs, rhs = self.on_value(stmt.lhs), self.on_value(stmt.rhs)
+        if lhs is stmt.lhs and rhs is stmt.rhs:
+            return stmt
+        return Assign(lhs, rhs)
 
     def on_Assert(self, stmt):
-        return Assert(self.on_value(stmt.test), _check=stmt._check, _en=stmt._en)
+        test = self.on_value(stmt.test)
+        if test is stmt.test:
+            return stmt
+        return Assert(test, _check=stmt._check, _en=stmt._en)
 
     def on_Assume(self, stmt):
-        return Assume(self.on_value(stmt.test), _check=stmt._check, _en=stmt._en)
+        test = self.on_value(stmt.test)
+        if test is stmt.test:
+            return stmt
+        return Assume(test, _check=stmt._check, _en=stmt._en)
 
     def on_Switch(self, stmt):
+        test  = self.on_value(stmt.test)
         cases = OrderedDict((k, self.on_statement(s)) for k, s in stmt.cases.items())
-        return Switch(self.on_value(stmt.test), cases)
+        if test is stmt.test and _unchanged(cases.values(), stmt.cases.values()):
+            return stmt
+        return Switch(test, cases)
 
     def on_statements(self, stmts):
-        return _StatementList(flatten(self.on_statement(stmt) for stmt in stmts))
+        new_stmts = [self.on_statement(stmt) for stmt in stmts]
+        if isinstance(stmts, _StatementList) and _unchanged(new_stmts, stmts):
+            return stmts
+        return _StatementList(flatten(new_stmts))
+
+    def __call__(self, value):
+        with _value_memo_scope(self):
+            return self.on_statement(value)
 
 
 class FragmentTransformer:
@@ -266,6 +440,27 @@ class FragmentTransformer:
         for domain, signal in fragment.iter_drivers():
             new_fragment.add_driver(signal, domain)
 
+    def _is_unchanged(self, fragment):
+        # Transformers that can tell that transforming a fragment would leave everything but
+        # its statements, named ports and subfragments unchanged override this method; if those
+        # come out of the transformation unchanged as well, the fragment is returned as-is.
+        return False
+
+    def _children_unchanged(self, fragment, new_fragment):
+        if len(new_fragment.statements) != len(fragment.statements):
+            return False
+        if not all(new_stmt is stmt
+                   for new_stmt, stmt in zip(new_fragment.statements, fragment.statements)):
+            return False
+        if isinstance(fragment, Instance):
+            if not all(new_value is value
+                       for (new_value, _), (value, _) in zip(new_fragment.named_ports.values(),
+                                                             fragment.named_ports.values())):
+                return False
+        return all(new_subfragment is subfragment
+                   for (new_subfragment, _), (subfragment, _) in zip(new_fragment.subfragments,
+                                                                     fragment.subfragments))
+
     def on_fragment(self, fragment):
         if isinstance(fragment, Instance):
             new_fragment = Instance(fragment.type)
@@ -279,11 +474,15 @@ class FragmentTransformer:
         self.map_domains(fragment, new_fragment)
         self.map_statements(fragment, new_fragment)
         self.map_drivers(fragment, new_fragment)
+        # Subfragments are transformed first, so whether they are unchanged is known by now.
+        if self._is_unchanged(fragment) and self._children_unchanged(fragment, new_fragment):
+            return fragment
         return new_fragment
 
     def __call__(self, value):
         if isinstance(value, Fragment):
-            return self.on_fragment(value)
+            with _value_memo_scope(self):
+                return self.on_fragment(value)
         elif isinstance(value, TransformedElaboratable):
             value._transforms_.append(self)
             return value
@@ -348,10 +547,23 @@ class DomainRenamer(FragmentTransformer, ValueTransformer, StatementTransformer)
             for signal in signals:
                 new_fragment.add_driver(signal, domain)
 
+    def _is_unchanged(self, fragment):
+        if any(domain in self.domain_map for domain in fragment.iter_domains()):
+            return False
+        return not any(domain in self.domain_map for domain in fragment.drivers)
+
 
 class DomainLowerer(FragmentTransformer, ValueTransformer, StatementTransformer):
-    def __init__(self, domains):
+    def __init__(self, domains, insert_resets=False):
         self.domains = domains
+        if insert_resets:
+            # Inserting the resets while lowering is equivalent to applying ResetInserter first,
+            # since the inserted statements do not refer to any domains, but rebuilds
+            # the fragment hierarchy only once.
+            self._reset_inserter = ResetInserter({cd.name: cd.rst for cd in domains.values()
+                                                  if cd.rst is not None})
+        else:
+            self._reset_inserter = None
 
     def _resolve(self, domain, context):
         if domain not in self.domains:
@@ -363,6 +575,12 @@ class DomainLowerer(FragmentTransformer, ValueTransformer, StatementTransformer)
         for domain, signal in fragment.iter_drivers():
             new_fragment.add_driver(self.on_value(signal), domain)
 
+    def on_fragment(self, fragment):
+        new_fragment = super().on_fragment(fragment)
+        if self._reset_inserter is not None:
+            self._reset_inserter._insert_controls(fragment, new_fragment)
+        return new_fragment
+
     def on_ClockSignal(self, value):
         cd = self._resolve(value.domain, value)
         return cd.clk
@@ -536,12 +754,15 @@ class _ControlInserter(FragmentTransformer):
             controls = {"sync": controls}
         self.controls = OrderedDict(controls)
 
-    def on_fragment(self, fragment):
-        new_fragment = super().on_fragment(fragment)
+    def _insert_controls(self, fragment, new_fragment):
         for domain, signals in fragment.drivers.items():
             if domain is None or domain not in self.controls:
                 continue
             self._insert_control(new_fragment, domain, signals)
+
+    def on_fragment(self, fragment):
+        new_fragment = super().on_fragment(fragment)
+        self._insert_controls(fragment, new_fragment)
         return new_fragment
 
     def _insert_control(self, fragment, domain, signals):
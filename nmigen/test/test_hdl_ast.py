@@ -1,4 +1,9 @@
+import os
+from contextlib import ExitStack
+from unittest.mock import patch
+
 from ..hdl.ast import *
+from .. import tracer
 from .tools import *
 
 
@@ -80,6 +85,13 @@ class ConstTestCase(FHDLTestCase):
     def test_normalization(self):
         self.assertEqual(Const(0b10110, (5, True)).value, -10)
 
+    def test_normalizer(self):
+        for shape in [(0, False), (1, False), (5, False), (1, True), (5, True), (70, True)]:
+            normalizer = Const.normalizer(shape)
+            for value in [0, 1, -1, 0b10110, -0b10110, 2 ** 80 + 5, True]:
+                self.assertEqual(normalizer(value), Const.normalize(value, shape))
+        self.assertIs(Const.normalizer((5, True)), Const.normalizer((5, True)))
+
     def test_value(self):
         self.assertEqual(Const(10).value, 10)
 
@@ -462,11 +474,61 @@ class SignalTestCase(FHDLTestCase):
         self.assertEqual(s1.attrs, {})
         s2 = Signal(attrs={"no_retiming": True})
         self.assertEqual(s2.attrs, {"no_retiming": True})
+        s1.attrs["keep"] = 1
+        self.assertEqual(s1.attrs, {"keep": 1})
+        self.assertEqual(Signal().attrs, {})
+
+    def test_slots(self):
+        s1 = Signal(4)
+        for value in [s1, Const(1), s1 + 1, s1[1:2], s1.part(s1, 1), Cat(s1, s1), Repl(s1, 2),
+                      ClockSignal(), ResetSignal(), AnyConst(2), Array([s1])[s1]]:
+            self.assertFalse(hasattr(value, "__dict__"), msg=repr(value))
 
     def test_repr(self):
         s1 = Signal()
         self.assertEqual(repr(s1), "(sig s1)")
 
+    def test_src_loc(self):
+        s1 = Signal()
+        self.assertEqual(s1.src_loc, (__file__, s1.src_loc[1]))
+        s2 = Signal(); s3 = Signal()
+        self.assertEqual(s2.src_loc, s3.src_loc)
+        self.assertEqual(s1.src_loc[1] + 2, s2.src_loc[1])
+        with tracer.no_src_loc():
+            s4 = Signal()
+        self.assertIsNone(s4.src_loc)
+        self.assertIsNotNone(Signal().src_loc)
+
+    def test_src_loc_env(self):
+        with patch.dict(os.environ):
+            for value in ("", "0", "false", "No", "OFF"):
+                os.environ["NMIGEN_NO_SRC_LOC"] = value
+                self.assertFalse(tracer._env_flag("NMIGEN_NO_SRC_LOC"))
+            for value in ("1", "true", "yes"):
+                os.environ["NMIGEN_NO_SRC_LOC"] = value
+                self.assertTrue(tracer._env_flag("NMIGEN_NO_SRC_LOC"))
+            del os.environ["NMIGEN_NO_SRC_LOC"]
+            self.assertFalse(tracer._env_flag("NMIGEN_NO_SRC_LOC"))
+
+    def test_name_cached(self):
+        signals = []
+        hits = tracer._get_store_name.cache_info().hits
+        for _ in range(3):
+            sig = Signal()
+            signals.append(sig)
+        self.assertEqual([s.name for s in signals], ["sig", "sig", "sig"])
+        self.assertGreaterEqual(tracer._get_store_name.cache_info().hits, hits + 2)
+
+    def test_shape_late(self):
+        s1 = Signal(2)
+        e = Cat(s1 + 1, s1)
+        self.assertEqual(e.shape(), (5, False))
+        s1.nbits = 4
+        self.assertEqual(e.shape(), (9, False))
+        s1.signed = True
+        self.assertEqual((s1 + 1).shape(), (5, True))
+        self.assertEqual(e.shape(), (9, False))
+
     def test_like(self):
         s1 = Signal.like(Signal(4))
         self.assertEqual(s1.shape(), (4, False))
@@ -484,6 +546,33 @@ class SignalTestCase(FHDLTestCase):
         s7 = [Signal.like(Signal(4))][0]
         self.assertEqual(s7.name, "$like")
 
+    def test_bank(self):
+        regs = Signal.bank(3, (4, True), reset=-1, attrs={"keep": 1})
+        self.assertEqual([s.name for s in regs], ["regs(0)", "regs(1)", "regs(2)"])
+        self.assertEqual([s.shape() for s in regs], [(4, True)] * 3)
+        self.assertEqual([s.reset for s in regs], [-1] * 3)
+        self.assertEqual(regs[1].duid, regs[0].duid + 1)
+        self.assertEqual(regs[2].duid, regs[0].duid + 2)
+        self.assertEqual(regs[0].attrs, {"keep": 1})
+        self.assertIsNot(regs[0].attrs, regs[1].attrs)
+        self.assertEqual(SignalSet(regs), SignalSet(reversed(regs)))
+        self.assertEqual(len(SignalSet(regs)), 3)
+
+        named = Signal.bank(2, 8, name_fmt="r{}_q")
+        self.assertEqual([s.name for s in named], ["r0_q", "r1_q"])
+        self.assertEqual(Signal.bank(0, 8), [])
+
+    def test_bank_wrong(self):
+        with self.assertRaises(TypeError,
+                msg="Signal count must be a non-negative integer, not '-1'"):
+            Signal.bank(-1, 8)
+        with self.assertRaises(TypeError,
+                msg="Name format must be a string, not '1'"):
+            Signal.bank(2, 8, name_fmt=1)
+        with self.assertRaises(TypeError,
+                msg="Width must be a non-negative integer, not '-10'"):
+            Signal.bank(2, -10)
+
 
 class ClockSignalTestCase(FHDLTestCase):
     def test_domain(self):
@@ -564,3 +653,122 @@ class SampleTestCase(FHDLTestCase):
         with self.assertRaises(ValueError,
                 "Cannot sample a value 1 cycles in the future"):
             Sample(Signal(), -1, "sync")
+
+
+class SignalsCacheTestCase(FHDLTestCase):
+    def test_rhs_signals(self):
+        a = Signal()
+        b = Signal()
+        c = Signal()
+        e1 = a | b
+        e2 = e1 & c
+        self.assertIs(e2._rhs_signals(), e2._rhs_signals())
+        self.assertIsInstance(e2._rhs_signals(), SignalSet)
+        self.assertEqual(e2._rhs_signals(), SignalSet((a, b, c)))
+        self.assertEqual(e1._rhs_signals(), SignalSet((a, b)))
+
+    def test_statement(self):
+        a = Signal()
+        b = Signal()
+        stmt = Switch(a, {1: b.eq(~a)})
+        self.assertIs(stmt._lhs_signals(), stmt._lhs_signals())
+        self.assertEqual(stmt._lhs_signals(), ValueSet((b,)))
+        self.assertEqual(stmt._rhs_signals(), ValueSet((a, b)))
+
+
+class InternedValuesTestCase(FHDLTestCase):
+    def test_not_interned(self):
+        self.assertIsNot(Const(1, 4), Const(1, 4))
+        a = Signal(4)
+        self.assertIsNot(a + 1, a + 1)
+
+    def test_interned(self):
+        a = Signal(4)
+        b = Signal(4)
+        with interned_values():
+            self.assertIs(Const(1, 4), Const(1, 4))
+            self.assertIsNot(Const(1, 4), Const(1, 5))
+            self.assertIsNot(Const(1, 4), Const(1, (4, True)))
+            self.assertIs(a[2:4] == 1, a[2:4] == 1)
+            self.assertIsNot(a[2:4] == 1, a[2:4] == 2)
+            self.assertIsNot(a + b, b + a)
+            self.assertIs(Cat(a, b), Cat(a, b))
+            self.assertIsNot(Cat(a, b), Cat(b, a))
+        self.assertIsNot(a[2:4], a[2:4])
+
+    def test_interned_src_loc(self):
+        a = Signal(4)
+        def build():
+            return a[2:4], Cat(a, a), Mux(a, 1, 2), a + 1
+        results = []
+        for interned in (False, True):
+            with ExitStack() as stack:
+                if interned:
+                    stack.enter_context(interned_values())
+                results.append((build(), build()))
+        (plain, _), (interned, interned_again) = results
+        self.assertIs(interned[0], interned_again[0])
+        for plain_value, interned_value in zip(plain, interned):
+            self.assertEqual(plain_value.src_loc, interned_value.src_loc)
+
+        # Values built by module-level code, not from inside a function.
+        code = compile("values = a[1:3], Cat(a, a), Mux(a, a, a), a + 1", "<module>", "exec")
+        results = []
+        for interned in (False, True):
+            with ExitStack() as stack:
+                if interned:
+                    stack.enter_context(interned_values())
+                scope = {"a": a, "Cat": Cat, "Mux": Mux}
+                exec(code, scope)
+            results.append(scope["values"])
+        plain, interned = results
+        self.assertEqual(plain[1].src_loc, ("<module>", 1))
+        for plain_value, interned_value in zip(plain, interned):
+            self.assertEqual(plain_value.src_loc, interned_value.src_loc)
+
+
+class ValueKeyTestCase(FHDLTestCase):
+    def test_structural(self):
+        a = Signal(4)
+        b = Signal(4)
+        self.assertEqual(ValueKey(a + b), ValueKey(a + b))
+        self.assertNotEqual(ValueKey(a + b), ValueKey(b + a))
+        self.assertEqual(ValueKey(a[1:3]), ValueKey(a[1:3]))
+        self.assertNotEqual(ValueKey(Cat(a)), ValueKey(Cat(a, b)))
+        self.assertNotEqual(ValueKey(Sample(a, 1, "sync")), ValueKey(Sample(a, 1, "pix")))
+        self.assertEqual(len(ValueSet([a + b, a + b, Cat(a), Cat(a, b)])), 3)
+
+    def test_hash_cached(self):
+        a = Signal(4)
+        e = a + 1
+        self.assertIsNone(e._structural_hash)
+        h = hash(ValueKey(e))
+        self.assertEqual(e._structural_hash, h)
+        self.assertEqual(hash(ValueKey(e)), h)
+
+
+class SignalCollectionsTestCase(FHDLTestCase):
+    def test_dict(self):
+        a = Signal()
+        b = Signal()
+        c = ClockSignal()
+        d = SignalDict([(b, 1), (c, 2), (a, 3), (None, 4)])
+        self.assertEqual(list(d), [b, c, a, None])
+        self.assertEqual(d[ClockSignal("sync")], 2)
+        self.assertNotIn(ResetSignal("sync"), d)
+        del d[b]
+        self.assertEqual(list(d.items())[0][1], 2)
+        self.assertEqual(d, SignalDict([(None, 4), (a, 3), (ClockSignal(), 2)]))
+        with self.assertRaises(TypeError,
+                msg="Object '(const 1'd1)' is not an nMigen signal"):
+            d[Const(1)]
+
+    def test_set(self):
+        a = Signal()
+        b = Signal()
+        s = SignalSet([b, a, b])
+        self.assertEqual(list(s), [b, a])
+        s.discard(b)
+        s.discard(b)
+        self.assertEqual(s, SignalSet([a]))
+        self.assertEqual(list(s | SignalSet([b])), [a, b])
@@ -626,6 +626,15 @@ class InstanceTestCase(FHDLTestCase):
             (self.pins, "io"),
         ]))
 
+    def test_prepare_timings(self):
+        self.setUp_cpu()
+        timings = {}
+        self.wrap.prepare(timings=timings)
+        self.assertEqual(list(timings), ["lower_samples", "propagate_domains",
+                                         "resolve_hierarchy_conflicts", "lower_domains",
+                                         "propagate_ports"])
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
     def test_prepare_explicit_ports(self):
         self.setUp_cpu()
         f = self.wrap.prepare(ports=[self.rst, self.stb])
@@ -1,6 +1,7 @@
 from ..hdl.ast import *
 from ..hdl.cd import *
 from ..hdl.ir import *
+from ..hdl.rec import *
 from ..hdl.xfrm import *
 from .tools import *
 
@@ -88,6 +89,88 @@ class DomainRenamerTestCase(FHDLTestCase):
             "pix": cd_pix,
         })
 
+    def test_rename_unchanged(self):
+        f1 = Fragment()
+        f1.add_statements(self.s1.eq(self.s2))
+        f1.add_driver(self.s1, "other")
+        f2 = Fragment()
+        f2.add_statements(self.s3.eq(ClockSignal()))
+        f2.add_driver(self.s3, None)
+        f3 = Fragment()
+        f3.add_statements(self.s4.eq(self.s5 + 1))
+        f3.add_driver(self.s4, "pix")
+        f1.add_subfragment(f2)
+        f1.add_subfragment(f3)
+
+        self.assertIs(DomainRenamer("pix")(f3), f3)
+        self.assertIs(DomainRenamer({"sync": "pix2"})(f3), f3)
+        self.assertIs(DomainRenamer("pix")(f2).statements[0].lhs, self.s3)
+
+        new_f1 = DomainRenamer("pix")(f1)
+        self.assertIsNot(new_f1, f1)
+        self.assertIs(new_f1.statements[0], f1.statements[0])
+        self.assertIsNot(new_f1.subfragments[0][0], f2)
+        self.assertIs(new_f1.subfragments[1][0], f3)
+        self.assertRepr(new_f1.subfragments[0][0].statements, """
+        (
+            (eq (sig s3) (clk pix))
+        )
+        """)
+
+        f4 = Fragment()
+        f4.add_driver(self.s1, "sync")
+        self.assertIsNot(DomainRenamer("pix")(f4), f4)
+
+    def test_rename_shared(self):
+        shared = self.s1 + ClockSignal()
+        f = Fragment()
+        f.add_statements(
+            self.s2.eq(shared),
+            self.s3.eq(shared[0]),
+        )
+
+        f = DomainRenamer("pix")(f)
+        self.assertEqual(repr(f.statements[0].rhs), "(+ (sig s1) (clk pix))")
+        self.assertIs(f.statements[1].rhs.value, f.statements[0].rhs)
+
+    def test_rename_dag(self):
+        value = ClockSignal()
+        for i in range(64):
+            value = value + value
+        f = Fragment()
+        f.add_statements(self.s1.eq(value))
+
+        f = DomainRenamer("pix")(f)
+        value = f.statements[0].rhs
+        for i in range(64):
+            self.assertIs(value.operands[0], value.operands[1])
+            value = value.operands[0]
+        self.assertEqual(repr(value), "(clk pix)")
+
+    def test_rename_memo_per_call(self):
+        f = Fragment()
+        f.add_statements(self.s1.eq(ClockSignal() + 1))
+
+        renamer = DomainRenamer("pix")
+        self.assertEqual(repr(renamer(f).statements[0].rhs), "(+ (clk pix) (const 1'd1))")
+        self.assertIsNone(renamer._value_memo)
+        renamer.domain_map["sync"] = "pix2"
+        self.assertEqual(repr(renamer(f).statements[0].rhs), "(+ (clk pix2) (const 1'd1))")
+
+    def test_rename_deep(self):
+        value = Const(0)
+        for i in range(5000):
+            value = Mux(self.s1, value, ClockSignal())
+        f = Fragment()
+        f.add_statements(self.s2.eq(value))
+
+        f = DomainRenamer("pix")(f)
+        value = f.statements[0].rhs
+        for i in range(5000):
+            self.assertEqual(repr(value.operands[2]), "(clk pix)")
+            value = value.operands[1]
+        self.assertEqual(repr(value), "(const 1'd0)")
+
 
 class DomainLowererTestCase(FHDLTestCase):
     def setUp(self):
@@ -121,6 +204,37 @@ class DomainLowererTestCase(FHDLTestCase):
         )
         """)
 
+    def test_lower_insert_resets(self):
+        sync = ClockDomain()
+        pix  = ClockDomain(reset_less=True)
+        f1 = Fragment()
+        f1.add_statements(
+            self.s.eq(ResetSignal("sync"))
+        )
+        f1.add_driver(self.s, "sync")
+        s2 = Signal(reset=1)
+        f2 = Fragment()
+        f2.add_statements(
+            s2.eq(ClockSignal("pix"))
+        )
+        f2.add_driver(s2, "pix")
+        f1.add_subfragment(f2)
+
+        f1 = DomainLowerer({"sync": sync, "pix": pix}, insert_resets=True)(f1)
+        self.assertRepr(f1.statements, """
+        (
+            (eq (sig s) (sig rst))
+            (switch (sig rst)
+                (case 1 (eq (sig s) (const 1'd0)))
+            )
+        )
+        """)
+        self.assertRepr(f1.subfragments[0][0].statements, """
+        (
+            (eq (sig s2) (sig pix_clk))
+        )
+        """)
+
     def test_lower_rst_reset_less(self):
         sync = ClockDomain(reset_less=True)
         f = Fragment()
@@ -584,3 +698,41 @@ class UserValueTestCase(FHDLTestCase):
             )
         )
         """)
+
+
+class _DispatchVisitor(ValueVisitor):
+    on_Const = on_AnyConst = on_AnySeq = on_Signal = on_ClockSignal = on_ResetSignal = \
+    on_Operator = on_Slice = on_Part = on_Repl = on_ArrayProxy = on_Sample = \
+        lambda self, value: type(value).__name__
+
+    def on_Record(self, value):
+        return "Record"
+
+    def on_Cat(self, value):
+        return "Cat"
+
+
+class ValueVisitorTestCase(FHDLTestCase):
+    def test_dispatch_subclass(self):
+        class MyRecord(Record):
+            pass
+
+        visitor = _DispatchVisitor()
+        self.assertEqual(visitor(Signal()), "Signal")
+        self.assertEqual(visitor(Const(1) + 1), "Operator")
+        self.assertEqual(visitor(MyRecord([("a", 1)])), "Record")
+        self.assertEqual(visitor(MockUserValue(Const(1))), "Const")
+        self.assertIn(MyRecord, _DispatchVisitor._value_methods)
+        self.assertNotIn(MyRecord, ValueTransformer._value_methods)
+
+    def test_dispatch_instance(self):
+        visitor = _DispatchVisitor()
+        visitor.on_Signal = lambda value: "instance"
+        self.assertEqual(visitor(Signal()), "instance")
+        self.assertEqual(_DispatchVisitor()(Signal()), "Signal")
+
+        a = Signal()
+        b = Signal()
+        transformer = ValueTransformer()
+        transformer.on_Signal = lambda value: b if value is a else value
+        self.assertEqual(repr(transformer(a + 1)), "(+ (sig b) (const 1'd1))")
@@ -1,4 +1,10 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
 from contextlib import contextmanager
+from unittest.mock import patch
 
 from .tools import *
 from ..tools import flatten, union
@@ -8,10 +14,15 @@ from ..hdl.mem import *
 from ..hdl.rec import *
 from ..hdl.dsl import  *
 from ..hdl.ir import *
+from ..lib.fifo import SyncFIFO
 from ..back.pysim import *
+from ..back.pysim import _strongly_connected_components
+from ..back.csim import _CFunclet
 
 
 class SimulatorUnitTestCase(FHDLTestCase):
+    engine = "python"
+
     def assertStatement(self, stmt, inputs, output, reset=0):
         inputs = [Value.wrap(i) for i in inputs]
         output = Value.wrap(output)
@@ -28,7 +39,8 @@ class SimulatorUnitTestCase(FHDLTestCase):
         with Simulator(frag,
                 vcd_file =open("test.vcd",  "w"),
                 gtkw_file=open("test.gtkw", "w"),
-                traces=[*isigs, osig]) as sim:
+                traces=[*isigs, osig],
+                engine=self.engine) as sim:
             def process():
                 for isig, input in zip(isigs, inputs):
                     yield isig.eq(input)
@@ -186,6 +198,10 @@ class SimulatorUnitTestCase(FHDLTestCase):
         stmt = lambda y, a: y.eq(Repl(a, 3))
         self.assertStatement(stmt, [C(0b10, 2)], C(0b101010, 6))
 
+    def test_repl_signed(self):
+        stmt = lambda y, a: y.eq(Repl(a, 2))
+        self.assertStatement(stmt, [C(-2, (4, True))], C(0b11101110, 8))
+
     def test_array(self):
         array = Array([1, 4, 10])
         stmt = lambda y, a: y.eq(array[a])
@@ -234,11 +250,23 @@ class SimulatorUnitTestCase(FHDLTestCase):
         for i in range(10):
             self.assertStatement(stmt, [C(i)], C(0))
 
+    def test_deep_mux(self):
+        def stmt(y, a):
+            value = Const(0, 12)
+            for i in range(2000):
+                value = Mux(a == i, i, value)
+            return y.eq(value)
+        self.assertStatement(stmt, [C(0, 12)], C(0, 12))
+        self.assertStatement(stmt, [C(1234, 12)], C(1234, 12))
+        self.assertStatement(stmt, [C(3000, 12)], C(0, 12))
+
 
 class SimulatorIntegrationTestCase(FHDLTestCase):
+    engine = "python"
+
     @contextmanager
     def assertSimulation(self, module, deadline=None):
-        with Simulator(module.elaborate(platform=None)) as sim:
+        with Simulator(module.elaborate(platform=None), engine=self.engine) as sim:
             yield sim
             if deadline is None:
                 sim.run()
@@ -289,6 +317,31 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                 self.assertEqual((yield self.count), 0)
             sim.add_sync_process(process)
 
+    def test_wait_until(self):
+        self.setUp_counter()
+        with self.assertSimulation(self.m) as sim:
+            sim.add_clock(1e-6)
+            timestamps = []
+            def process_wait_until():
+                yield WaitUntil(self.count == 7)
+                self.assertEqual((yield self.count), 7)
+                timestamps.append(sim._timestamp)
+                yield WaitUntil(self.count == 7)
+                timestamps.append(sim._timestamp)
+                yield WaitUntil(self.count == 2)
+                self.assertEqual((yield self.count), 2)
+                timestamps.append(sim._timestamp)
+            def process_loop():
+                for value in (7, 7, 2):
+                    while (yield self.count) != value:
+                        yield
+                    timestamps.append(sim._timestamp)
+            sim.add_sync_process(process_wait_until)
+            sim.add_sync_process(process_loop)
+        self.assertEqual(timestamps[0::2], timestamps[1::2])
+        self.assertEqual(timestamps[0], timestamps[2])
+        self.assertNotEqual(timestamps[0], timestamps[4])
+
     def setUp_alu(self):
         self.a = Signal(8)
         self.b = Signal(8)
@@ -381,6 +434,36 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                 self.fail()
             sim.add_process(process)
 
+    def test_integer_timebase(self):
+        with self.assertSimulation(Module()) as sim:
+            def process():
+                for _ in range(30000):
+                    yield Delay(1e-10)
+            sim.add_process(process)
+        self.assertEqual(sim._timestamp, 3000000000)
+
+    def test_resolution_wrong(self):
+        with self.assertRaises(ValueError,
+                msg="Simulation resolution 3e-12 cannot be used as a VCD timescale; the "
+                    "resolution must be 1, 10 or 100 s, ms, us, ns, ps or fs"):
+            with Simulator(Module(), vcd_file=io.StringIO(), resolution=3e-12) as sim:
+                pass
+
+    def test_trace_filter(self):
+        m = Module()
+        a1 = Signal(name="a")
+        a2 = Signal(name="a")
+        b  = Signal()
+        m.d.comb += [a1.eq(~a2), b.eq(a1)]
+        with open("test.vcd", "w") as vcd_file:
+            with Simulator(m, vcd_file=vcd_file, gtkw_file=open("test.gtkw", "w"),
+                           traces=[b], trace_filter=lambda name: name != "top.b",
+                           engine=self.engine) as sim:
+                sim.run()
+        with open("test.vcd") as vcd_file:
+            names = [line.split()[4] for line in vcd_file if line.startswith("$var")]
+        self.assertEqual(sorted(names), ["a", "a$1"])
+
     def test_add_process_wrong(self):
         with self.assertSimulation(Module()) as sim:
             with self.assertRaises(TypeError,
@@ -604,8 +687,292 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_sync_process(process_gen)
             sim.add_sync_process(process_check)
 
+    def assertFIFOStreams(self, fifo):
+        with Simulator(fifo, engine=self.engine) as sim:
+            sim.add_clock(1e-6)
+            writer = sim.add_fifo_writer(fifo)
+            reader = sim.add_fifo_reader(fifo)
+            writer.feed(range(50))
+            writer.feed([0xff] * 10)
+            reader.expect(60)
+            sim.run()
+            self.assertEqual(len(writer), 0)
+            self.assertEqual(reader.drain(5), [0, 1, 2, 3, 4])
+            self.assertEqual(reader.drain(), list(range(5, 50)) + [0xff] * 10)
+
+    def test_fifo_stream_fwft(self):
+        self.assertFIFOStreams(SyncFIFO(width=8, depth=4, fwft=True))
+
+    def test_fifo_stream_not_fwft(self):
+        self.assertFIFOStreams(SyncFIFO(width=8, depth=4, fwft=False))
+
+    def test_stream_wrong(self):
+        self.setUp_alu()
+        with self.assertSimulation(self.m) as sim:
+            with self.assertRaises(ValueError,
+                    msg="Cannot add a stream driving signal '(sig x)', which is a part of "
+                        "combinatorial assignment in simulation"):
+                sim.add_stream_writer(self.x, self.a, self.b)
+
+    def test_instance_model(self):
+        a = Signal(4)
+        b = Signal(4)
+        y = Signal(5)
+        q = Signal(5)
+        m = Module()
+        m.domains.sync = ClockDomain()
+        m.submodules.add = Instance("ADD", i_A=a, i_B=b, o_Y=y)
+        m.submodules.reg = Instance("DFF", i_C=ClockSignal(), i_D=y, o_Q=q)
+
+        def add_model(instance):
+            return lambda ports: {"Y": ports["A"] + ports["B"]}
+        def dff_model(instance):
+            data = {}
+            def eval(ports):
+                if ports["C"]:
+                    data["Q"] = ports["D"]
+                return data
+            return eval
+
+        sim = Simulator(m, engine=self.engine)
+        sim.add_instance_model("ADD", add_model)
+        sim.add_instance_model("DFF", dff_model, sensitivity=["C"])
+        with sim:
+            def process():
+                yield a.eq(3)
+                yield b.eq(9)
+                yield Delay()
+                self.assertEqual((yield y), 12)
+                self.assertEqual((yield q), 0)
+                yield Tick()
+                yield Delay(1e-7)
+                self.assertEqual((yield q), 12)
+            sim.add_clock(1e-6)
+            sim.add_process(process)
+            sim.run()
+
+    def test_instance_model_wrong(self):
+        m = Module()
+        m.submodules.add = Instance("ADD", i_A=Signal(), o_Y=Signal())
+        sim = Simulator(m, engine=self.engine)
+        with self.assertRaises(NameError,
+                msg="Instance model for 'ADD' is sensitive to port 'Y', which is not an input "
+                    "port"):
+            sim.add_instance_model("ADD", lambda instance: None, sensitivity=["Y"])
+            sim.__enter__()
+
+    def test_instance_no_model(self):
+        m = Module()
+        m.submodules.add = Instance("ADD", i_A=Signal(), o_Y=Signal())
+        with self.assertWarns(UserWarning,
+                msg="Instance 'top.add' of type 'ADD' has no simulation model; its outputs "
+                    "will remain at their reset values"):
+            sim = Simulator(m, engine=self.engine)
+            sim.__enter__()
+            sim.run()
+
+    def setUp_accumulator(self, reset=0):
+        self.i = Signal(8)
+        self.o = Signal(8, reset=reset)
+        m = Module()
+        m.domains.sync = ClockDomain()
+        m.d.sync += self.o.eq(self.o + self.i)
+        return m
+
+    def test_stimulus_replay(self):
+        log = io.BytesIO()
+        with Simulator(self.setUp_accumulator(), engine=self.engine) as sim:
+            sim.record_stimulus(log)
+            sim.add_clock(1e-6)
+            def process():
+                for value in (3, 1, 4, 1, 5, 9, 2, 6):
+                    yield self.i.eq(value)
+                    yield
+                    yield self.o
+            sim.add_sync_process(process)
+            sim.run()
+        self.assertEqual(sim._state.curr[sim._signal_slots[self.o]], 31)
+
+        log.seek(0)
+        with Simulator(self.setUp_accumulator(), engine=self.engine) as sim:
+            sim.replay_stimulus(log, check=True)
+            sim.run()
+        self.assertEqual(sim._state.curr[sim._signal_slots[self.o]], 31)
+
+    def test_stimulus_replay_wrong(self):
+        log = io.BytesIO()
+        with Simulator(self.setUp_accumulator(), engine=self.engine) as sim:
+            sim.record_stimulus(log)
+            sim.add_clock(1e-6)
+            def process():
+                yield self.i.eq(1)
+                yield
+                yield self.o
+            sim.add_sync_process(process)
+            sim.run()
+
+        log.seek(0)
+        with Simulator(self.setUp_accumulator(reset=1), engine=self.engine) as sim:
+            sim.replay_stimulus(log, check=True)
+            with self.assertRaises(ReplayError,
+                    msg="Signal '(sig o)' has value 1 at 1.5e-06 s, but the recorded value is 0"):
+                sim.run()
+
+        sim = Simulator(self.setUp_accumulator(), engine=self.engine)
+        with self.assertRaises(ValueError,
+                msg="Stimulus can only be recorded after the simulation is started"):
+            sim.record_stimulus(io.BytesIO())
+        with self.assertRaises(ValueError,
+                msg="Stimulus can only be replayed after the simulation is started"):
+            sim.replay_stimulus(io.BytesIO())
+        sim.__enter__()
+        with self.assertRaises(ReplayError,
+                msg="Stimulus log has an unrecognized format"):
+            sim.replay_stimulus(io.BytesIO(b"garbage!"))
+
+    def setUp_coverage(self):
+        self.go = Signal()
+        self.q  = Signal(4)
+        self.m  = Module()
+        self.m.domains.sync = ClockDomain()
+        with self.m.FSM():
+            with self.m.State("IDLE"):
+                with self.m.If(self.go):
+                    self.m.next = "RUN"
+            with self.m.State("RUN"):
+                self.m.d.sync += self.q.eq(self.q + 1)
+                with self.m.If(self.q == 2):
+                    self.m.next = "IDLE"
+            with self.m.State("DONE"):
+                pass
+
+    def test_coverage(self):
+        self.setUp_coverage()
+        with Simulator(self.m, coverage=True, engine=self.engine) as sim:
+            sim.add_clock(1e-6)
+            def process():
+                yield self.go.eq(1)
+                yield
+                yield self.go.eq(0)
+                for _ in range(4):
+                    yield
+            sim.add_sync_process(process)
+            sim.run()
+        coverage = sim.coverage
+        self.assertEqual(coverage.toggles["top.q"], (4, 0b0011, 0b0001))
+        self.assertEqual(coverage.toggles["top.go"], (1, 1, 1))
+        self.assertEqual(coverage.fsm_states("top.fsm"), ["IDLE", "RUN"])
+        self.assertEqual(coverage.fsm_transitions("top.fsm"), [("IDLE", "RUN"), ("RUN", "IDLE")])
+        self.assertEqual(list(coverage.cases["top.switch2"].keys()), ["00", "01", "10"])
+        self.assertEqual(coverage.cases["top.switch2"]["10"], 0)
+        hits = coverage.cases["top.switch2"]["01"]
+
+        file = io.StringIO()
+        coverage.save(file)
+        file.seek(0)
+        coverage.merge(Coverage.load(file))
+        self.assertEqual(coverage.toggles["top.q"], (4, 0b0011, 0b0001))
+        self.assertEqual(coverage.fsm_states("top.fsm"), ["IDLE", "RUN"])
+        self.assertEqual(coverage.cases["top.switch2"]["01"], hits * 2)
+
+    def test_coverage_disabled(self):
+        self.setUp_coverage()
+        with Simulator(self.m, engine=self.engine) as sim:
+            sim.run()
+        self.assertIsNone(sim.coverage)
+
+    def test_comb_loop(self):
+        a = Signal()
+        b = Signal()
+        c = Signal()
+        m = Module()
+        m.d.comb += [
+            a.eq(b),
+            b.eq(a | c),
+            c[0].eq(1),
+        ]
+        with self.assertWarns(UserWarning,
+                msg="Combinatorial loop detected between signals top.a ({}:{}), top.b ({}:{})"
+                    .format(*a.src_loc, *b.src_loc)):
+            with self.assertSimulation(m) as sim:
+                pass
+
+    def test_strongly_connected_components(self):
+        self.assertEqual(_strongly_connected_components([[1], [2, 3], [1], []]),
+                         [[0], [2, 1], [3]])
+        chain = [[vertex + 1] for vertex in range(100000)] + [[]]
+        self.assertEqual(len(_strongly_connected_components(chain)), 100001)
+
     def test_wrong_not_run(self):
         with self.assertWarns(UserWarning,
                 msg="Simulation created, but not run"):
             with Simulator(Fragment()) as sim:
                 pass
+
+
+def _isolate_csim_cache(test_case):
+    # Keep the libraries built by the tests out of the user's cache.
+    cache_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(cache_dir.cleanup)
+    environ = patch.dict(os.environ, {"NMIGEN_CSIM_CACHE": cache_dir.name})
+    environ.start()
+    test_case.addCleanup(environ.stop)
+
+
+@unittest.skipUnless(shutil.which(os.getenv("CC", "cc")), "C compiler not available")
+class CSimulatorUnitTestCase(SimulatorUnitTestCase):
+    engine = "c"
+
+    def setUp(self):
+        _isolate_csim_cache(self)
+
+
+@unittest.skipUnless(shutil.which(os.getenv("CC", "cc")), "C compiler not available")
+class CSimulatorIntegrationTestCase(SimulatorIntegrationTestCase):
+    engine = "c"
+
+    def setUp(self):
+        _isolate_csim_cache(self)
+
+    def test_c_funclets(self):
+        self.setUp_counter()
+        with self.assertSimulation(self.m) as sim:
+            sim.add_clock(1e-6)
+            def process():
+                for _ in range(3):
+                    yield
+                self.assertEqual((yield self.count), 7)
+            sim.add_sync_process(process)
+        self.assertTrue(any(isinstance(funclet, _CFunclet)
+                            for funclets in sim._funclets for funclet in funclets))
+
+    def test_c_wide_fallback(self):
+        a = Signal(100)
+        b = Signal(100)
+        m = Module()
+        m.d.comb += b.eq(a + 1)
+        with self.assertSimulation(m) as sim:
+            def process():
+                yield a.eq(2 ** 99)
+                yield Delay()
+                self.assertEqual((yield b), 2 ** 99 + 1)
+            sim.add_process(process)
+        self.assertFalse(any(isinstance(funclet, _CFunclet)
+                             for funclets in sim._funclets for funclet in funclets))
+
+    def test_c_cache_pruned(self):
+        with patch("nmigen.back.csim._CACHE_LIMIT", 1):
+            for width in (2, 3):
+                a = Signal(width)
+                m = Module()
+                m.d.comb += a.eq(a + 1)
+                with Simulator(m, engine=self.engine) as sim:
+                    sim.run()
+        cache_dir = os.environ["NMIGEN_CSIM_CACHE"]
+        self.assertEqual(len([name for name in os.listdir(cache_dir)
+                              if name.endswith(".so")]), 1)
+
+    def test_engine_wrong(self):
+        with self.assertRaises(ValueError,
+                msg="Simulator engine must be one of 'python' or 'c', not 'verilator'"):
+            Simulator(Module(), engine="verilator")
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+from .tools import *
+from ..hdl.ast import *
+from ..hdl.cd import *
+from ..hdl.dsl import *
+from ..back.pysim import *
+from ..back.vcddiff import diff
+
+
+class VCDDiffTestCase(FHDLTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.traces    = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def trace_file(self):
+        self.traces += 1
+        return os.path.join(self.directory.name, "{}.vcd".format(self.traces))
+
+    def simulate(self, reset, resolution=1e-15):
+        count = Signal(4, reset=reset)
+        state = Signal(2, decoder=lambda value: ["A", "B", "C", "D"][value])
+        m = Module()
+        m.domains.sync = ClockDomain()
+        m.d.sync += [
+            count.eq(count + 1),
+            state.eq(count[:2]),
+        ]
+        vcd_name = self.trace_file()
+        with Simulator(m, vcd_file=open(vcd_name, "w"), resolution=resolution) as sim:
+            sim.add_clock(1e-6)
+            sim.run_until(10e-6, run_passive=True)
+        return open(vcd_name)
+
+    def test_same(self):
+        self.assertEqual(diff(self.simulate(reset=0), self.simulate(reset=0)), {})
+
+    def test_timescale(self):
+        self.assertEqual(diff(self.simulate(reset=0), self.simulate(reset=0, resolution=1e-10)),
+                         {})
+
+    def test_different(self):
+        divergences = diff(self.simulate(reset=0), self.simulate(reset=1), limit=2)
+        self.assertEqual(list(divergences), ["top.count", "top.state"])
+        self.assertEqual(divergences["top.count"], [(0, 0, 1), (500000000, 1, 2)])
+        self.assertEqual(divergences["top.state"], [(500000000, "A", "B"), (1500000000, "B", "C")])
+
+    def test_missing(self):
+        m = Module()
+        m.d.comb += Signal(name="other").eq(1)
+        vcd_name = self.trace_file()
+        with Simulator(m, vcd_file=open(vcd_name, "w")) as sim:
+            sim.run()
+        divergences = diff(self.simulate(reset=0), open(vcd_name))
+        self.assertEqual(divergences["top.count"], [(0, "x", None)])
+        self.assertEqual(divergences["top.other"], [(0, None, "x")])
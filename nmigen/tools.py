@@ -21,7 +21,8 @@ def union(i, start=None):
     r = start
     for e in i:
         if r is None:
-            r = e
+            # Copy the first set, so that none of the arguments are mutated.
+            r = type(e)(e)
         else:
             r |= e
     return r
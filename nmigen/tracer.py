@@ -1,9 +1,11 @@
-import traceback
-import inspect
+import os
+import sys
+from functools import lru_cache
+from contextlib import contextmanager
 from opcode import opname
 
 
-__all__ = ["NameNotFound", "get_var_name", "get_src_loc"]
+__all__ = ["NameNotFound", "get_var_name", "get_src_loc", "no_src_loc"]
 
 
 class NameNotFound(Exception):
@@ -13,14 +15,11 @@ class NameNotFound(Exception):
 _raise_exception = object()
 
 
-def get_var_name(depth=2, default=_raise_exception):
-    frame = inspect.currentframe()
-    for _ in range(depth):
-        frame = frame.f_back
-
-    code = frame.f_code
-    call_index = frame.f_lasti
-    call_opc   = opname[code.co_code[call_index]]
+@lru_cache(maxsize=4096)
+def _get_store_name(code, call_index):
+    # Returns the name that the result of the call at `call_index` is stored to, None if
+    # the instruction is not a call, or NameNotFound (the class) if there is no store target.
+    call_opc = opname[code.co_code[call_index]]
     if call_opc not in ("CALL_FUNCTION", "CALL_FUNCTION_KW", "CALL_FUNCTION_EX", "CALL_METHOD"):
         return None
 
@@ -40,17 +39,55 @@ def get_var_name(depth=2, default=_raise_exception):
                      "DUP_TOP", "BUILD_LIST"):
             index += 2
         else:
-            if default is _raise_exception:
-                raise NameNotFound
-            else:
-                return default
+            return NameNotFound
+
+
+def get_var_name(depth=2, default=_raise_exception):
+    frame = sys._getframe(depth)
+    name = _get_store_name(frame.f_code, frame.f_lasti)
+    if name is NameNotFound:
+        if default is _raise_exception:
+            raise NameNotFound
+        else:
+            return default
+    return name
+
+
+def _env_flag(name):
+    return os.getenv(name, "").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+_src_loc_enabled = not _env_flag("NMIGEN_NO_SRC_LOC")
 
 
 def get_src_loc(src_loc_at=0):
     # n-th  frame: get_src_loc()
     # n-1th frame: caller of get_src_loc() (usually constructor)
     # n-2th frame: caller of caller (usually user code)
-    # Python returns the stack frames reversed, so it is enough to set limit and grab the very
-    # first one in the array.
-    tb = traceback.extract_stack(limit=3 + src_loc_at)
-    return (tb[0].filename, tb[0].lineno)
+    # Only the raw code location is read; unlike traceback.extract_stack(), this does not
+    # build FrameSummary objects or consult linecache. If the stack is shallower than requested,
+    # the outermost frame is used.
+    if not _src_loc_enabled:
+        return None
+    frame = sys._getframe(1)
+    for _ in range(1 + src_loc_at):
+        if frame.f_back is None:
+            break
+        frame = frame.f_back
+    return (frame.f_code.co_filename, frame.f_lineno)
+
+
+@contextmanager
+def no_src_loc():
+    """Disable source location capture.
+
+    Within this context, and everywhere if the ``NMIGEN_NO_SRC_LOC`` environment variable is set
+    to a true value (anything other than ``0``, ``false``, ``no``, ``off`` or empty),
+    :func:`get_src_loc` returns ``None`` and no source locations are recorded for new objects.
+    """
+    global _src_loc_enabled
+    enabled, _src_loc_enabled = _src_loc_enabled, False
+    try:
+        yield
+    finally:
+        _src_loc_enabled = enabled